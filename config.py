@@ -34,6 +34,7 @@ WEB_PORT = int(os.getenv("PORT", "8081"))  # Railway устанавливает
 
 # Настройки базы данных (PostgreSQL для Railway)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///rsi_signals.db")  # Fallback для локальной разработки
+SIGNAL_RETENTION_DAYS = int(os.getenv("SIGNAL_RETENTION_DAYS", "30"))  # Сигналы старше удаляются раз в сутки
 
 # Настройки уведомлений
 CHECK_INTERVAL = 60  # секунд между проверками (1 минута)
@@ -78,6 +79,9 @@ PATTERNS = {
 }
 
 # Проверка обязательных переменных окружения
+# (вызывается при запуске бота в RSIBot.__init__, а не при импорте: модуль
+# конфигурации импортируют и утилиты, которым токены Telegram не нужны).
+# Значения модуля не замораживаются: пороги RSI меняются из веб-настроек на лету
 def validate_config():
     """Проверка наличия обязательных переменных окружения"""
     required_vars = {
@@ -90,4 +94,4 @@ def validate_config():
     if missing_vars:
         raise ValueError(f"Отсутствуют обязательные переменные окружения: {', '.join(missing_vars)}")
     
-    return True 
\ No newline at end of file
+    return True
@@ -1,9 +1,9 @@
 import asyncio
 import logging
+import numpy as np
 import pandas as pd
-from binance.client import Client
 from datetime import datetime, timedelta
-import pandas_ta as ta
+from rsi_utils import wilder_rsi
 
 logger = logging.getLogger(__name__)
 
@@ -11,11 +11,15 @@ class BinanceConnector:
     def __init__(self, config):
         """Инициализация подключения к Binance"""
         try:
+            # Импортируем клиент только при создании коннектора:
+            # публичный режим работы не должен платить за загрузку python-binance
+            from binance.client import Client
+            
             self.client = Client(config.BINANCE_API_KEY, config.BINANCE_API_SECRET)
             self.config = config
             logger.info("Подключение к Binance установлено")
         except Exception as e:
-            logger.error(f"Ошибка при подключении к Binance: {str(e)}")
+            logger.error("Ошибка при подключении к Binance: %s", e)
             self.client = None
             
     def __enter__(self):
@@ -34,7 +38,7 @@ class BinanceConnector:
             self.client.ping()
             return True
         except Exception as e:
-            logger.error(f"Ошибка при проверке подключения к Binance: {str(e)}")
+            logger.error("Ошибка при проверке подключения к Binance: %s", e)
             return False
             
     async def get_historical_data(self, symbol: str, timeframe: str, limit: int = 100) -> pd.DataFrame:
@@ -48,7 +52,7 @@ class BinanceConnector:
                 logger.error("Неверный тип параметров")
                 return None
                 
-            logger.info(f"Запрашиваем {limit} свечей для {symbol} на {timeframe}")
+            logger.info("Запрашиваем %s свечей для %s на %s", limit, symbol, timeframe)
             
             # Получаем данные
             klines = self.client.get_historical_klines(
@@ -58,38 +62,37 @@ class BinanceConnector:
             )
             
             if not klines:
-                logger.error(f"Не удалось получить данные для {symbol} на таймфрейме {timeframe}")
+                logger.error("Не удалось получить данные для %s на таймфрейме %s", symbol, timeframe)
                 return None
                 
-            # Преобразуем данные в DataFrame
-            df = pd.DataFrame(klines, columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 'volume',
-                'close_time', 'quote_volume', 'trades', 'taker_buy_base',
-                'taker_buy_quote', 'ignored'
-            ])
-                                             
-            # Конвертируем типы данных
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            numeric_columns = ['open', 'high', 'low', 'close', 'volume']
-            df[numeric_columns] = df[numeric_columns].astype(float)
+            # Разбираем только нужные колонки (open, high, low, close, volume)
+            # сразу в float64, остальные 7 полей свечи не аллоцируем
+            ohlcv = np.array([kline[1:6] for kline in klines], dtype=np.float64)
+            timestamps = np.asarray([kline[0] for kline in klines], dtype=np.int64).view('datetime64[ms]')
             
-            # Устанавливаем timestamp как индекс
-            df.set_index('timestamp', inplace=True)
+            df = pd.DataFrame({
+                'open': ohlcv[:, 0],
+                'high': ohlcv[:, 1],
+                'low': ohlcv[:, 2],
+                'close': ohlcv[:, 3],
+                'volume': ohlcv[:, 4]
+            }, index=pd.DatetimeIndex(timestamps, name='timestamp', copy=False))
             
             # Вычисляем RSI
-            df['rsi'] = ta.rsi(df['close'], length=self.config.RSI_PERIOD)
-            
-            # Удаляем строки с NaN значениями RSI
-            df = df.dropna(subset=['rsi'])
+            rsi_period = self.config.RSI_PERIOD
+            close = df['close'].to_numpy(dtype=np.float64)
+            rsi = wilder_rsi(close, rsi_period)
             
-            # Возвращаем только нужное количество свечей
-            df = df.tail(limit)
+            # RSI определен начиная со строки RSI_PERIOD: отрезаем NaN-префикс
+            # и оставляем нужное количество свечей одним срезом
+            start = max(rsi_period, len(close) - limit)
+            df = df.iloc[start:].assign(rsi=rsi[start:])
             
-            logger.info(f"Получено {len(df)} свечей для {symbol} с RSI")
+            logger.info("Получено %s свечей для %s с RSI", len(df), symbol)
             return df
             
         except Exception as e:
-            logger.error(f"Ошибка при получении исторических данных: {str(e)}")
+            logger.error("Ошибка при получении исторических данных: %s", e)
             return None
             
     async def get_current_price(self, symbol: str) -> float:
@@ -103,7 +106,7 @@ class BinanceConnector:
                 return float(ticker['price'])
             return None
         except Exception as e:
-            logger.error(f"Ошибка при получении текущей цены: {str(e)}")
+            logger.error("Ошибка при получении текущей цены: %s", e)
             return None
             
     def close(self):
@@ -113,4 +116,4 @@ class BinanceConnector:
                 self.client.close_connection()
                 logger.info("Соединение с Binance закрыто")
         except Exception as e:
-            logger.error(f"Ошибка при закрытии соединения: {str(e)}") 
\ No newline at end of file
+            logger.error("Ошибка при закрытии соединения: %s", e) 
\ No newline at end of file
@@ -1,145 +1,168 @@
 import asyncio
 import logging
+import aiohttp
+import orjson
+import numpy as np
 import pandas as pd
-import requests
 from datetime import datetime, timedelta
-import pandas_ta as ta
 import time
+from rsi_utils import wilder_rsi, wilder_state
 
 logger = logging.getLogger(__name__)
 
+# Таймфреймы, поддерживаемые Binance
+_VALID_TFS = frozenset(['1m', '3m', '5m', '15m', '30m', '1h', '2h', '4h', '6h', '8h', '12h', '1d'])
+
 class BinancePublicConnector:
-    def __init__(self, config):
+    def __init__(self, config, http: aiohttp.ClientSession = None):
         """Инициализация подключения к публичному API Binance"""
         self.config = config
         self.base_url = "https://api.binance.com/api/v3"
-        self.last_request_time = 0
+        
+        # Общая HTTP-сессия (передается гибридным коннектором) или собственная
+        self.session = http
+        self._owns_session = http is None
+        
+        # Не более 10 одновременных запросов и минимум 100ms между их стартами
+        self._semaphore = asyncio.Semaphore(10)
+        self._rate_lock = asyncio.Lock()
+        self._next_request_time = 0
         logger.info("Binance Public API коннектор инициализирован")
         
-    def _rate_limit(self):
-        """Ограничение частоты запросов"""
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
+    def supports(self, symbol: str) -> bool:
+        """Символы бота заданы в формате спотовых пар Binance"""
+        return True
         
-        # Минимум 100ms между запросами
-        if time_since_last_request < 0.1:
-            time.sleep(0.1 - time_since_last_request)
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Общая HTTP-сессия с пулом соединений (создается лениво внутри event loop)"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=60)
+            )
+            self._owns_session = True
+        return self.session
+        
+    async def _rate_limit(self):
+        """Ограничение частоты запросов (token bucket без блокировки event loop)"""
+        async with self._rate_lock:
+            current_time = time.monotonic()
+            delay = self._next_request_time - current_time
+            
+            # Минимум 100ms между запросами
+            self._next_request_time = max(current_time, self._next_request_time) + 0.1
             
-        self.last_request_time = time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
         
-    def _convert_timeframe(self, timeframe: str) -> str:
-        """Конвертация таймфрейма в формат Binance"""
-        timeframe_mapping = {
-            '1m': '1m',
-            '3m': '3m',
-            '5m': '5m',
-            '15m': '15m',
-            '30m': '30m',
-            '1h': '1h',
-            '2h': '2h',
-            '4h': '4h',
-            '6h': '6h',
-            '8h': '8h',
-            '12h': '12h',
-            '1d': '1d'
+    async def _fetch_klines(self, symbol: str, timeframe: str, rows: int) -> pd.DataFrame:
+        """Запрос последних rows свечей (последняя еще формируется), None если данных нет"""
+        # Таймфреймы Binance совпадают с нашими, неизвестные заменяем на 5m
+        binance_timeframe = timeframe if timeframe in _VALID_TFS else '5m'
+        
+        logger.info("Запрашиваем данные для %s на %s", symbol, binance_timeframe)
+        
+        # Подготавливаем параметры запроса
+        params = {
+            'symbol': symbol,
+            'interval': binance_timeframe,
+            'limit': rows
         }
         
-        return timeframe_mapping.get(timeframe, '5m')
+        # Делаем запрос к публичному API Binance
+        url = f"{self.base_url}/klines"
+        async with self._semaphore:
+            await self._rate_limit()
+            async with self._get_session().get(url, params=params, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                if response.status != 200:
+                    logger.error("Ошибка API Binance: %s, %s", response.status, await response.text())
+                    return None
+                    
+                data = orjson.loads(await response.read())
         
+        if not data:
+            logger.warning("Нет данных для %s", symbol)
+            return None
+            
+        # Разбираем только нужные колонки (open, high, low, close, volume)
+        # сразу в float64, остальные 7 полей свечи не аллоцируем
+        ohlcv = np.array([kline[1:6] for kline in data], dtype=np.float64)
+        timestamps = np.asarray([kline[0] for kline in data], dtype=np.int64).view('datetime64[ms]')
+        
+        return pd.DataFrame({
+            'open': ohlcv[:, 0],
+            'high': ohlcv[:, 1],
+            'low': ohlcv[:, 2],
+            'close': ohlcv[:, 3],
+            'volume': ohlcv[:, 4]
+        }, index=pd.DatetimeIndex(timestamps, name='timestamp', copy=False))
+        
+    async def get_candles(self, symbol: str, timeframe: str, limit: int) -> pd.DataFrame:
+        """
+        Последние limit свечей без RSI и без запаса на его прогрев: гибридный коннектор
+        продолжает по ним RSI от сохраненного состояния Уайлдера
+        """
+        try:
+            return await self._fetch_klines(symbol, timeframe, limit)
+        except Exception as e:
+            logger.error("Ошибка при получении свечей для %s: %s", symbol, e)
+            return None
+            
     async def get_historical_data(self, symbol: str, timeframe: str, limit: int = 100) -> pd.DataFrame:
         """Получение исторических данных с RSI"""
         try:
-            # Применяем rate limiting
-            self._rate_limit()
-            
-            # Конвертируем таймфрейм
-            binance_timeframe = self._convert_timeframe(timeframe)
-            
-            logger.info(f"Запрашиваем данные для {symbol} на {binance_timeframe}")
-            
-            # Подготавливаем параметры запроса
-            params = {
-                'symbol': symbol,
-                'interval': binance_timeframe,
-                'limit': limit + 50  # Запрашиваем больше для расчета RSI
-            }
-            
-            # Делаем запрос к публичному API Binance
-            url = f"{self.base_url}/klines"
-            response = requests.get(url, params=params, timeout=30)
-            
-            if response.status_code != 200:
-                logger.error(f"Ошибка API Binance: {response.status_code}, {response.text}")
+            # Запрашиваем больше свечей для расчета RSI
+            df = await self._fetch_klines(symbol, timeframe, limit + 50)
+            if df is None:
                 return None
                 
-            data = response.json()
-            
-            if not data:
-                logger.warning(f"Нет данных для {symbol}")
-                return None
-                
-            # Создаем DataFrame
-            df = pd.DataFrame(data, columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 'volume',
-                'close_time', 'quote_volume', 'trades', 'taker_buy_base',
-                'taker_buy_quote', 'ignored'
-            ])
-            
-            # Конвертируем типы данных
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            numeric_columns = ['open', 'high', 'low', 'close', 'volume']
-            df[numeric_columns] = df[numeric_columns].astype(float)
-            
-            # Устанавливаем timestamp как индекс
-            df.set_index('timestamp', inplace=True)
-            
-            # Убираем строки с NaN
-            df = df.dropna()
-            
             if len(df) < 20:
-                logger.warning(f"Недостаточно данных для {symbol}: {len(df)} строк")
+                logger.warning("Недостаточно данных для %s: %s строк", symbol, len(df))
                 return None
                 
             # Вычисляем RSI
-            df['rsi'] = ta.rsi(df['close'], length=self.config.RSI_PERIOD)
-            
-            # Удаляем строки с NaN значениями RSI
-            df = df.dropna(subset=['rsi'])
-            
-            # Возвращаем только нужное количество свечей
-            df = df.tail(limit)
-            
-            logger.info(f"Получено {len(df)} свечей для {symbol} с RSI (последний RSI: {df['rsi'].iloc[-1]:.2f})")
+            rsi_period = self.config.RSI_PERIOD
+            close = df['close'].to_numpy(dtype=np.float64)
+            rsi = wilder_rsi(close, rsi_period)
+            
+            # RSI определен начиная со строки RSI_PERIOD: отрезаем NaN-префикс
+            # и оставляем нужное количество свечей одним срезом
+            start = max(rsi_period, len(close) - limit)
+            df = df.iloc[start:].assign(rsi=rsi[start:])
+            # Состояние Уайлдера на последней закрытой свече (последняя еще формируется):
+            # по нему гибридный коннектор продолжает RSI на новых свечах без полной загрузки
+            df.attrs['rsi_state'] = wilder_state(close[:-1], rsi_period)
+            
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Получено %s свечей для %s с RSI (последний RSI: %.2f)", len(df), symbol, df['rsi'].iloc[-1])
             return df
             
         except Exception as e:
-            logger.error(f"Ошибка при получении данных для {symbol}: {str(e)}")
+            logger.error("Ошибка при получении данных для %s: %s", symbol, e)
             return None
             
     async def get_current_price(self, symbol: str) -> float:
         """Получение текущей цены"""
         try:
-            # Применяем rate limiting
-            self._rate_limit()
-            
             url = f"{self.base_url}/ticker/price"
             params = {'symbol': symbol}
             
-            response = requests.get(url, params=params, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if 'price' in data:
-                    return float(data['price'])
+            async with self._semaphore:
+                await self._rate_limit()
+                async with self._get_session().get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    if response.status == 200:
+                        data = orjson.loads(await response.read())
+                        if 'price' in data:
+                            return float(data['price'])
                     
-            logger.warning(f"Не удалось получить цену для {symbol}")
+            logger.warning("Не удалось получить цену для %s", symbol)
             return None
             
         except Exception as e:
-            logger.error(f"Ошибка при получении цены для {symbol}: {str(e)}")
+            logger.error("Ошибка при получении цены для %s: %s", symbol, e)
             return None
             
-    def close(self):
-        """Заглушка для совместимости"""
-        logger.info("Binance Public API коннектор закрыт")
-        pass 
\ No newline at end of file
+    async def close(self):
+        """Закрытие HTTP-сессии (общую сессию закрывает ее владелец)"""
+        if self._owns_session and self.session is not None and not self.session.closed:
+            await self.session.close()
+        logger.info("Binance Public API коннектор закрыт") 
\ No newline at end of file
@@ -1,46 +1,76 @@
 import asyncio
 import logging
+import aiohttp
+import numpy as np
+import orjson
 import pandas as pd
-import requests
 from datetime import datetime, timedelta
-import pandas_ta as ta
 import time
+from rsi_utils import wilder_rsi, wilder_state
 
 logger = logging.getLogger(__name__)
 
+# Маппинг символов в CoinGecko IDs
+_SYMBOL_MAP = {
+    'BTCUSDT': 'bitcoin',
+    'DOGEUSDT': 'dogecoin',
+    'PEPEUSDT': 'pepe',
+    'SUIUSDT': 'sui',
+    'BIGTIMEUSDT': 'big-time',
+    'ALTUSDT': 'altlayer',
+    'WLDUSDT': 'worldcoin-wld'
+}
+_SYMBOL_MAP_GET = _SYMBOL_MAP.get
+
 class CoinGeckoConnector:
-    def __init__(self, config):
+    def __init__(self, config, http: aiohttp.ClientSession = None):
         """Инициализация подключения к CoinGecko API"""
         self.config = config
         self.base_url = "https://api.coingecko.com/api/v3"
-        self.last_request_time = 0
+        
+        # Общая HTTP-сессия (передается гибридным коннектором) или собственная
+        self.session = http
+        self._owns_session = http is None
+        
+        self._rate_lock = asyncio.Lock()
+        self._next_request_time = 0
         logger.info("CoinGecko коннектор инициализирован")
         
+    def supports(self, symbol: str) -> bool:
+        """Может ли CoinGecko в принципе обслужить символ"""
+        return symbol in _SYMBOL_MAP
+        
     def _convert_symbol_to_coingecko(self, symbol: str) -> str:
         """Конвертация символа в CoinGecko ID"""
-        # Маппинг символов в CoinGecko IDs
-        symbol_mapping = {
-            'BTCUSDT': 'bitcoin',
-            'DOGEUSDT': 'dogecoin',
-            'PEPEUSDT': 'pepe',
-            'SUIUSDT': 'sui',
-            'BIGTIMEUSDT': 'big-time',
-            'ALTUSDT': 'altlayer',
-            'WLDUSDT': 'worldcoin-wld'
-        }
+        return _SYMBOL_MAP_GET(symbol)
         
-        return symbol_mapping.get(symbol, None)
+    def _get_session(self) -> aiohttp.ClientSession:
+        """HTTP-сессия коннектора (создается лениво, если общая не передана)"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=60)
+            )
+            self._owns_session = True
+        return self.session
         
-    def _rate_limit(self):
-        """Ограничение частоты запросов (бесплатный API: 10-50 запросов в минуту)"""
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
+    async def _get_json(self, url: str, params: dict, timeout: float):
+        """GET-запрос: возвращает HTTP статус и разобранный JSON (None при ошибке)"""
+        async with self._get_session().get(url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status != 200:
+                return response.status, None
+            return response.status, orjson.loads(await response.read())
         
-        # Минимум 2 секунды между запросами
-        if time_since_last_request < 2:
-            time.sleep(2 - time_since_last_request)
+    async def _rate_limit(self):
+        """Ограничение частоты запросов (бесплатный API: 10-50 запросов в минуту)"""
+        async with self._rate_lock:
+            current_time = time.monotonic()
+            delay = self._next_request_time - current_time
+            
+            # Минимум 2 секунды между запросами
+            self._next_request_time = max(current_time, self._next_request_time) + 2
             
-        self.last_request_time = time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
         
     async def get_historical_data(self, symbol: str, timeframe: str, limit: int = 100) -> pd.DataFrame:
         """Получение исторических данных с RSI"""
@@ -49,13 +79,13 @@ class CoinGeckoConnector:
             coingecko_id = self._convert_symbol_to_coingecko(symbol)
             
             if coingecko_id is None:
-                logger.warning(f"Символ {symbol} не поддерживается CoinGecko")
+                logger.warning("Символ %s не поддерживается CoinGecko", symbol)
                 return None
                 
-            logger.info(f"Запрашиваем данные для {coingecko_id} ({symbol})")
+            logger.info("Запрашиваем данные для %s (%s)", coingecko_id, symbol)
             
             # Применяем rate limiting
-            self._rate_limit()
+            await self._rate_limit()
             
             # Определяем количество дней для получения данных
             if timeframe == '5m':
@@ -76,53 +106,61 @@ class CoinGeckoConnector:
                 }
                 
             # Делаем запрос
-            response = requests.get(url, params=params, timeout=30)
+            status, data = await self._get_json(url, params, 30)
             
-            if response.status_code != 200:
-                logger.error(f"Ошибка API CoinGecko: {response.status_code}")
+            if status != 200:
+                logger.error("Ошибка API CoinGecko: %s", status)
                 return None
-                
-            data = response.json()
             
             if 'prices' not in data or not data['prices']:
-                logger.warning(f"Нет данных цен для {symbol}")
+                logger.warning("Нет данных цен для %s", symbol)
                 return None
                 
-            # Создаем DataFrame из данных цен
+            # Создаем DataFrame из данных цен одним построением из NumPy-массивов
             prices = data['prices']
-            df = pd.DataFrame(prices, columns=['timestamp', 'close'])
-            
-            # Конвертируем timestamp в datetime
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            df.set_index('timestamp', inplace=True)
-            
-            # Добавляем необходимые колонки (для простоты используем close как все цены)
-            df['open'] = df['close'].shift(1).fillna(df['close'])
-            df['high'] = df['close'] * 1.01  # Примерное значение
-            df['low'] = df['close'] * 0.99   # Примерное значение
-            df['volume'] = 1000000  # Фиктивное значение объема
+            close = np.array([price[1] for price in prices], dtype=np.float64)
+            timestamps = np.asarray([price[0] for price in prices], dtype=np.int64).view('datetime64[ms]')
+            
+            # Добавляем необходимые колонки (для простоты используем close как все цены):
+            # open - предыдущий close, high/low - примерные значения, объем фиктивный
+            opens = np.empty_like(close)
+            opens[0] = close[0]
+            opens[1:] = close[:-1]
+            
+            df = pd.DataFrame({
+                'open': opens,
+                'high': close * 1.01,
+                'low': close * 0.99,
+                'close': close,
+                'volume': np.full_like(close, 1e6)
+            }, index=pd.DatetimeIndex(timestamps, name='timestamp', copy=False))
             
             # Убираем строки с NaN
             df = df.dropna()
             
             if len(df) < 20:
-                logger.warning(f"Недостаточно данных для {symbol}: {len(df)} строк")
+                logger.warning("Недостаточно данных для %s: %s строк", symbol, len(df))
                 return None
                 
             # Вычисляем RSI
-            df['rsi'] = ta.rsi(df['close'], length=self.config.RSI_PERIOD)
-            
-            # Удаляем строки с NaN значениями RSI
-            df = df.dropna(subset=['rsi'])
-            
-            # Возвращаем только нужное количество свечей
-            df = df.tail(limit)
-            
-            logger.info(f"Получено {len(df)} свечей для {symbol} с RSI (последний RSI: {df['rsi'].iloc[-1]:.2f})")
+            rsi_period = self.config.RSI_PERIOD
+            close = df['close'].to_numpy(dtype=np.float64)
+            rsi = wilder_rsi(close, rsi_period)
+            
+            # RSI определен начиная со строки RSI_PERIOD: отрезаем NaN-префикс
+            # и оставляем нужное количество свечей одним срезом
+            start = max(rsi_period, len(close) - limit)
+            df = df.iloc[start:].assign(rsi=rsi[start:])
+            # Состояние Уайлдера на последней закрытой свече (последняя еще формируется):
+            # по нему гибридный коннектор продолжает RSI на новых свечах без полной загрузки
+            df.attrs['rsi_state'] = wilder_state(close[:-1], rsi_period)
+            
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Получено %s свечей для %s с RSI (последний RSI: %.2f)", len(df), symbol, df['rsi'].iloc[-1])
             return df
             
         except Exception as e:
-            logger.error(f"Ошибка при получении данных для {symbol}: {str(e)}")
+            logger.error("Ошибка при получении данных для %s: %s", symbol, e)
             return None
             
     async def get_current_price(self, symbol: str) -> float:
@@ -131,11 +169,11 @@ class CoinGeckoConnector:
             coingecko_id = self._convert_symbol_to_coingecko(symbol)
             
             if coingecko_id is None:
-                logger.warning(f"Символ {symbol} не поддерживается CoinGecko")
+                logger.warning("Символ %s не поддерживается CoinGecko", symbol)
                 return None
                 
             # Применяем rate limiting
-            self._rate_limit()
+            await self._rate_limit()
                 
             url = f"{self.base_url}/simple/price"
             params = {
@@ -143,21 +181,21 @@ class CoinGeckoConnector:
                 'vs_currencies': 'usd'
             }
             
-            response = requests.get(url, params=params, timeout=10)
+            status, data = await self._get_json(url, params, 10)
             
-            if response.status_code == 200:
-                data = response.json()
+            if status == 200:
                 if coingecko_id in data and 'usd' in data[coingecko_id]:
                     return float(data[coingecko_id]['usd'])
                     
-            logger.warning(f"Не удалось получить цену для {symbol}")
+            logger.warning("Не удалось получить цену для %s", symbol)
             return None
             
         except Exception as e:
-            logger.error(f"Ошибка при получении цены для {symbol}: {str(e)}")
+            logger.error("Ошибка при получении цены для %s: %s", symbol, e)
             return None
             
-    def close(self):
-        """Заглушка для совместимости"""
-        logger.info("CoinGecko коннектор закрыт")
-        pass 
\ No newline at end of file
+    async def close(self):
+        """Закрытие HTTP-сессии (общую сессию закрывает ее владелец)"""
+        if self._owns_session and self.session is not None and not self.session.closed:
+            await self.session.close()
+        logger.info("CoinGecko коннектор закрыт") 
\ No newline at end of file
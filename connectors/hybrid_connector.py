@@ -1,21 +1,70 @@
 import asyncio
 import logging
+import aiohttp
+import time
+from collections import deque
+import numpy as np
 import pandas as pd
+from typing import Dict, List, Tuple
+from rsi_utils import wilder_extend
 from .kraken_connector import KrakenConnector
-from .coingecko_connector import CoinGeckoConnector  
+from .coingecko_connector import CoinGeckoConnector
 from .yahoo_connector import YahooConnector
 from .binance_public_connector import BinancePublicConnector
 
 logger = logging.getLogger(__name__)
 
+# Длительность свечи в секундах для каждого таймфрейма
+TIMEFRAME_SECONDS = {
+    '1m': 60,
+    '3m': 180,
+    '5m': 300,
+    '15m': 900,
+    '30m': 1800,
+    '1h': 3600,
+    '2h': 7200,
+    '4h': 14400,
+    '6h': 21600,
+    '8h': 28800,
+    '12h': 43200,
+    '1d': 86400
+}
+
+# Резервный запрос к следующему коннектору уходит, если основной не ответил
+# за 95-й перцентиль своих последних задержек (секунды, до накопления замеров - HEDGE_DELAY)
+HEDGE_DELAY = 1.0
+HEDGE_PERCENTILE = 95
+LATENCY_SAMPLES = 50
+LATENCY_MIN_SAMPLES = 10
+
+
+def _rsi_state(df: pd.DataFrame):
+    """
+    Точное состояние (avg_gain, avg_loss) на последней закрытой свече,
+    которое коннектор отдал вместе с данными (None, если его нет).
+    Без него новая свеча приводит к полной загрузке, а не к продолжению RSI.
+    """
+    state = df.attrs.get('rsi_state')
+    if state is None or len(df) < 2 or np.isnan(state[0]) or np.isnan(state[1]):
+        return None
+    return state
+
+
 class HybridConnector:
     def __init__(self, config):
         """Гибридный коннектор с несколькими источниками данных"""
         self.config = config
-        self.kraken_connector = KrakenConnector(config)
-        self.coingecko_connector = CoinGeckoConnector(config)
+        
+        # Один пул TCP/TLS соединений на все REST-источники
+        # (rate limiting у каждого коннектора остается своим)
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=8, keepalive_timeout=60)
+        )
+        
+        self.kraken_connector = KrakenConnector(config, http=self.http)
+        self.coingecko_connector = CoinGeckoConnector(config, http=self.http)
         self.yahoo_connector = YahooConnector(config)
-        self.binance_connector = BinancePublicConnector(config)
+        self.binance_connector = BinancePublicConnector(config, http=self.http)
         
         # Приоритет коннекторов для каждого символа
         self.priority_map = {
@@ -28,89 +77,298 @@ class HybridConnector:
             'WLDUSDT': ['binance', 'yahoo', 'coingecko']
         }
         
+        # Заранее разворачиваем приоритеты в цепочки (имя, коннектор),
+        # чтобы не собирать словарь коннекторов на каждый запрос
+        connectors = {
+            'kraken': self.kraken_connector,
+            'coingecko': self.coingecko_connector,
+            'yahoo': self.yahoo_connector,
+            'binance': self.binance_connector
+        }
+        self._connectors = connectors
+        self._resolved = {
+            symbol: self._build_chain(symbol, names)
+            for symbol, names in self.priority_map.items()
+        }
+        
+        # Кэш исторических данных:
+        # (symbol, timeframe) -> (номер свечи, limit, DataFrame, avg_gain, avg_loss, источник),
+        # где avg_gain/avg_loss - состояние RSI Уайлдера на последней закрытой свече,
+        # посчитанное по ценам коннектора-источника
+        self._cache: Dict[Tuple[str, str], Tuple[int, int, pd.DataFrame, float, float, str]] = {}
+        
+        # Последние задержки успешных ответов: (коннектор, вид запроса) -> секунды
+        self._latency: Dict[Tuple[str, str], deque] = {}
+        
         logger.info("Гибридный коннектор инициализирован")
         
-    async def get_historical_data(self, symbol: str, timeframe: str, limit: int = 100) -> pd.DataFrame:
-        """Получение исторических данных из наилучшего источника"""
-        try:
-            connectors = {
-                'kraken': self.kraken_connector,
-                'coingecko': self.coingecko_connector,
-                'yahoo': self.yahoo_connector,
-                'binance': self.binance_connector
-            }
-            
-            # Получаем приоритетный список коннекторов для символа
-            priority_list = self.priority_map.get(symbol, ['binance', 'kraken', 'yahoo', 'coingecko'])
-            
-            logger.info(f"Попытка получить данные для {symbol} через: {priority_list}")
+    def _build_chain(self, symbol: str, names) -> tuple:
+        """Цепочка (имя, коннектор) для символа без заведомо неподдерживаемых источников"""
+        return tuple(
+            (name, connector) for name in names
+            if (connector := self._connectors.get(name)) is not None
+            and connector.supports(symbol)
+        )
+        
+    def _get_chain(self, symbol: str) -> tuple:
+        """Цепочка коннекторов для символа (для новых символов строится один раз)"""
+        chain = self._resolved.get(symbol)
+        if chain is None:
+            chain = self._build_chain(symbol, ('binance', 'kraken', 'yahoo', 'coingecko'))
+            self._resolved[symbol] = chain
+        return chain
+        
+    def _hedge_delay(self, name: str, kind: str) -> float:
+        """Сколько ждать ответа коннектора, прежде чем подключить следующий по цепочке"""
+        samples = self._latency.get((name, kind))
+        if samples is None or len(samples) < LATENCY_MIN_SAMPLES:
+            return HEDGE_DELAY
+        return float(np.percentile(samples, HEDGE_PERCENTILE))
+        
+    def _record_latency(self, name: str, kind: str, seconds: float):
+        """Учет задержки успешного ответа коннектора"""
+        samples = self._latency.get((name, kind))
+        if samples is None:
+            samples = self._latency[(name, kind)] = deque(maxlen=LATENCY_SAMPLES)
+        samples.append(seconds)
+        
+    async def _first_result(self, symbol: str, chain: tuple, kind: str, make_call, is_valid):
+        """
+        Опрос цепочки коннекторов: возвращает (имя, результат) первого коннектора,
+        вернувшего валидный ответ, оставшиеся запросы отменяются.
+        
+        Одновременно в полете не больше двух запросов: следующий по приоритету коннектор
+        подключается, если текущий не ответил за 95-й перцентиль своих задержек
+        (см. _hedge_delay) или вернул ошибку. Так быстрый основной источник
+        не тратит квоты резервных, а медленные вызовы Yahoo в потоках не плодятся.
+        """
+        tasks = {}
+        next_position = 0
+        
+        def start_next():
+            nonlocal next_position
+            name, connector = chain[next_position]
+            task = asyncio.create_task(make_call(connector))
+            tasks[task] = (next_position, name, time.monotonic())
+            next_position += 1
             
-            for connector_name in priority_list:
-                if connector_name not in connectors:
-                    continue
-                    
-                try:
-                    logger.info(f"Пробуем {connector_name} для {symbol}")
-                    connector = connectors[connector_name]
+        try:
+            if chain:
+                start_next()
+                
+            while tasks:
+                # Один запрос в полете и есть резерв - ждем не дольше задержки хеджирования
+                timeout = None
+                if len(tasks) == 1 and next_position < len(chain):
+                    _, name, started = next(iter(tasks.values()))
+                    timeout = max(0.0, self._hedge_delay(name, kind) - (time.monotonic() - started))
                     
-                    df = await connector.get_historical_data(symbol, timeframe, limit)
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    start_next()
+                    continue
+                
+                # При одновременном завершении предпочитаем более приоритетный источник
+                for task in sorted(done, key=lambda t: tasks[t][0]):
+                    _, connector_name, started = tasks.pop(task)
                     
-                    if df is not None and len(df) > 0:
-                        logger.info(f"✅ Успешно получены данные для {symbol} через {connector_name}")
-                        return df
-                    else:
-                        logger.warning(f"❌ {connector_name} не вернул данных для {symbol}")
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        logger.warning("❌ Ошибка в %s для %s: %s", connector_name, symbol, e)
+                        continue
                         
-                except Exception as e:
-                    logger.warning(f"❌ Ошибка в {connector_name} для {symbol}: {str(e)}")
-                    continue
+                    if is_valid(result):
+                        self._record_latency(connector_name, kind, time.monotonic() - started)
+                        return connector_name, result
+                        
+                    logger.warning("❌ %s не вернул данных для %s", connector_name, symbol)
+                    
+                # Отказавший коннектор сразу заменяем следующим по цепочке
+                if not tasks and next_position < len(chain):
+                    start_next()
                     
-            logger.error(f"❌ Все коннекторы не смогли получить данные для {symbol}")
+            return None, None
+            
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+    def _get_bucket(self, timeframe: str):
+        """Номер текущей свечи таймфрейма (None для неизвестного таймфрейма)"""
+        timeframe_seconds = TIMEFRAME_SECONDS.get(timeframe)
+        if timeframe_seconds is None:
             return None
+        return int(time.time() // timeframe_seconds)
+        
+    async def _update_incremental(self, symbol: str, timeframe: str, cached, new_candles: int):
+        """
+        Обновление формирующейся свечи и дополнение кэша новыми свечами
+        с пересчетом RSI за O(1) на свечу.
+        Возвращает новую запись кэша или None, если нужна полная загрузка.
+        
+        Свечи запрашиваются только у коннектора, по ценам которого посчитано
+        сохраненное состояние: цены другого источника с ним не согласуются.
+        """
+        _, cached_limit, cached_df, avg_gain, avg_loss, source = cached
+        anchor = cached_df.index[-2]
+        
+        # Без отдельного запроса последних свечей (get_candles) продолжать нечего -
+        # коннектор отдает только полную историю с RSI
+        connector = self._connectors[source]
+        if not hasattr(connector, 'get_candles'):
+            return None
+            
+        _, fresh = await self._first_result(
+            symbol,
+            ((source, connector),),
+            'candles',
+            lambda connector: connector.get_candles(symbol, timeframe, new_candles + 2),
+            lambda df: df is not None and len(df) > 0
+        )
+        
+        # Без общей закрытой свечи склеить ряды нельзя (пропуск данных)
+        if fresh is None or anchor not in fresh.index:
+            return None
+            
+        tail = fresh.loc[fresh.index > anchor]
+        if tail.empty:
+            return None
+            
+        # Состояние сохраняется только по закрытым свечам, последняя еще формируется
+        rsi, avg_gain, avg_loss = wilder_extend(
+            avg_gain,
+            avg_loss,
+            float(fresh.at[anchor, 'close']),
+            tail['close'].to_numpy(dtype=np.float64),
+            self.config.RSI_PERIOD
+        )
+        
+        df = pd.concat([cached_df.loc[:anchor], tail.assign(rsi=rsi)]).tail(cached_limit)
+        df.attrs['rsi_state'] = (avg_gain, avg_loss)
+        return df, avg_gain, avg_loss
+        
+    def _store_history(self, symbol: str, timeframe: str, bucket, limit: int, df: pd.DataFrame, source: str):
+        """Запись полной загрузки в кэш вместе с состоянием RSI и коннектором-источником"""
+        if bucket is not None:
+            state = _rsi_state(df) or (None, None)
+            self._cache[(symbol, timeframe)] = (bucket, limit, df, *state, source)
+            
+    async def get_historical_data(self, symbol: str, timeframe: str, limit: int = 100, skip: tuple = ()) -> pd.DataFrame:
+        """
+        Получение исторических данных из наилучшего источника
+        
+        skip - имена коннекторов, которые не опрашиваются при полной загрузке
+        (их вызывающий код опрашивает сам, см. get_historical_data_batch)
+        """
+        try:
+            # Закрытые свечи повторно используем из кэша, а формирующуюся (и новые, если
+            # они появились) запрашиваем на каждый вызов и продолжаем по ним RSI
+            cache_key = (symbol, timeframe)
+            bucket = self._get_bucket(timeframe)
+            cached = self._cache.get(cache_key)
+            
+            if cached is not None and bucket is not None and cached[1] >= limit:
+                cached_bucket, cached_limit = cached[0], cached[1]
+                if cached[3] is not None and 0 <= bucket - cached_bucket < limit:
+                    updated = await self._update_incremental(symbol, timeframe, cached, bucket - cached_bucket)
+                    if updated is not None:
+                        df, avg_gain, avg_loss = updated
+                        self._cache[cache_key] = (bucket, cached_limit, df, avg_gain, avg_loss, cached[5])
+                        logger.info("Данные для %s на %s обновлены инкрементально", symbol, timeframe)
+                        return df.tail(limit)
+            
+            # Получаем приоритетную цепочку коннекторов для символа
+            chain = self._get_chain(symbol)
+            if skip:
+                chain = tuple((name, connector) for name, connector in chain if name not in skip)
+            
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Попытка получить данные для %s через: %s", symbol, [name for name, _ in chain])
+            
+            connector_name, df = await self._first_result(
+                symbol,
+                chain,
+                'history',
+                lambda connector: connector.get_historical_data(symbol, timeframe, limit),
+                lambda df: df is not None and len(df) > 0
+            )
+            
+            if df is None:
+                # С пропущенными коннекторами итог подводит вызывающий код
+                if not skip:
+                    logger.error("❌ Все коннекторы не смогли получить данные для %s", symbol)
+                return None
+                
+            logger.info("✅ Успешно получены данные для %s через %s", symbol, connector_name)
+            self._store_history(symbol, timeframe, bucket, limit, df, connector_name)
+            return df
             
         except Exception as e:
-            logger.error(f"Ошибка в гибридном коннекторе для {symbol}: {str(e)}")
+            logger.error("Ошибка в гибридном коннекторе для %s: %s", symbol, e)
             return None
             
+    async def get_historical_data_batch(self, symbols: List[str], timeframe: str, limit: int = 100) -> Dict[str, pd.DataFrame]:
+        """
+        Параллельное получение исторических данных для нескольких символов
+        
+        Yahoo во всех цепочках - резервный источник: символы, которых не отдал ни один
+        другой коннектор, догружаются из Yahoo одним запросом yf.download, а не
+        отдельным Ticker.history на каждый символ
+        """
+        frames = await asyncio.gather(
+            *[self.get_historical_data(symbol, timeframe, limit, skip=('yahoo',)) for symbol in symbols]
+        )
+        results = dict(zip(symbols, frames))
+        
+        missing = [
+            symbol for symbol, df in results.items()
+            if df is None and self.yahoo_connector.supports(symbol)
+        ]
+        if missing:
+            bucket = self._get_bucket(timeframe)
+            yahoo_frames = await self.yahoo_connector.get_historical_data_batch(missing, timeframe, limit)
+            for symbol, df in yahoo_frames.items():
+                if df is not None and len(df) > 0:
+                    logger.info("✅ Успешно получены данные для %s через yahoo", symbol)
+                    self._store_history(symbol, timeframe, bucket, limit, df, 'yahoo')
+                    results[symbol] = df
+                    
+        for symbol, df in results.items():
+            if df is None:
+                logger.error("❌ Все коннекторы не смогли получить данные для %s", symbol)
+                
+        return results
+            
     async def get_current_price(self, symbol: str) -> float:
         """Получение текущей цены из наилучшего источника"""
         try:
-            connectors = {
-                'kraken': self.kraken_connector,
-                'coingecko': self.coingecko_connector,
-                'yahoo': self.yahoo_connector,
-                'binance': self.binance_connector
-            }
+            chain = self._get_chain(symbol)
             
-            priority_list = self.priority_map.get(symbol, ['binance', 'kraken', 'yahoo', 'coingecko'])
+            connector_name, price = await self._first_result(
+                symbol,
+                chain,
+                'price',
+                lambda connector: connector.get_current_price(symbol),
+                lambda price: price is not None and price > 0
+            )
             
-            for connector_name in priority_list:
-                if connector_name not in connectors:
-                    continue
-                    
-                try:
-                    connector = connectors[connector_name]
-                    price = await connector.get_current_price(symbol)
-                    
-                    if price is not None and price > 0:
-                        logger.info(f"✅ Получена цена для {symbol} через {connector_name}: ${price}")
-                        return price
-                        
-                except Exception as e:
-                    logger.warning(f"❌ Ошибка получения цены в {connector_name} для {symbol}: {str(e)}")
-                    continue
-                    
-            logger.error(f"❌ Все коннекторы не смогли получить цену для {symbol}")
-            return None
+            if price is None:
+                logger.error("❌ Все коннекторы не смогли получить цену для %s", symbol)
+                return None
+                
+            logger.info("✅ Получена цена для %s через %s: $%s", symbol, connector_name, price)
+            return price
             
         except Exception as e:
-            logger.error(f"Ошибка получения цены в гибридном коннекторе для {symbol}: {str(e)}")
+            logger.error("Ошибка получения цены в гибридном коннекторе для %s: %s", symbol, e)
             return None
             
-    def close(self):
+    async def close(self):
         """Закрытие всех коннекторов"""
-        self.kraken_connector.close()
-        self.coingecko_connector.close()
+        await self.kraken_connector.close()
+        await self.coingecko_connector.close()
         self.yahoo_connector.close()
-        self.binance_connector.close()
+        await self.binance_connector.close()
+        await self.http.close()
         logger.info("Гибридный коннектор закрыт") 
\ No newline at end of file
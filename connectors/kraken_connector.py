@@ -1,183 +1,316 @@
 import asyncio
 import logging
+import aiohttp
+import numpy as np
+import orjson
 import pandas as pd
-import requests
 from datetime import datetime, timedelta
-import pandas_ta as ta
-import time
+from rsi_utils import wilder_rsi, wilder_state, wilder_extend
+from .rate_limit import AsyncTokenBucket
+from .response_cache import ResponseCache, SingleFlight, HISTORY_TTL, PRICE_TTL
+
+try:
+    import talib
+except ImportError:  # TA-Lib не установлен - RSI считается ядром wilder_rsi
+    talib = None
 
 logger = logging.getLogger(__name__)
 
+# Маппинг символов в Kraken формат
+_SYMBOL_MAP = {
+    'BTCUSDT': 'XXBTZUSD',
+    'DOGEUSDT': 'DOGEUSD',
+    'PEPEUSDT': 'PEPEUSD',  # Возможно поддерживается
+    'SUIUSDT': 'SUIUSD',   # Возможно поддерживается
+    # Эти монеты могут не поддерживаться Kraken:
+    # 'BIGTIMEUSDT', 'ALTUSDT', 'WLDUSDT'
+    # Для них будем использовать другие коннекторы
+}
+
+# Таймфреймы Kraken (в минутах)
+_TIMEFRAME_MAP = {
+    '1m': 1,
+    '5m': 5,
+    '15m': 15,
+    '30m': 30,
+    '1h': 60,
+    '4h': 240,
+    '1d': 1440
+}
+
 class KrakenConnector:
-    def __init__(self, config):
+    def __init__(self, config, http: aiohttp.ClientSession = None):
         """Инициализация подключения к публичному API Kraken"""
         self.config = config
         self.base_url = "https://api.kraken.com/0/public"
-        self.last_request_time = 0
+        
+        # Общая HTTP-сессия (передается гибридным коннектором) или собственная
+        self.session = http
+        self._owns_session = http is None
+        
+        # Не больше 3 одновременных запросов, в среднем 1 запрос в секунду со всплеском до 3
+        self._sem = asyncio.Semaphore(3)
+        self._bucket = AsyncTokenBucket(rate=1.0, burst=3)
+        
+        # Кэш ответов API (исторические данные и цены)
+        self._cache = ResponseCache()
+        self._inflight = SingleFlight()
+        
+        # Состояние RSI Уайлдера: (symbol, interval) -> (DataFrame, avg_gain, avg_loss)
+        self._rsi_state = {}
         logger.info("Kraken Public API коннектор инициализирован")
         
+    def supports(self, symbol: str) -> bool:
+        """Может ли Kraken в принципе обслужить символ"""
+        return symbol in _SYMBOL_MAP
+        
     def _convert_symbol_to_kraken(self, symbol: str) -> str:
         """Конвертация символа в формат Kraken"""
-        # Маппинг символов в Kraken формат
-        symbol_mapping = {
-            'BTCUSDT': 'XXBTZUSD',
-            'DOGEUSDT': 'DOGEUSD',
-            'PEPEUSDT': 'PEPEUSD',  # Возможно поддерживается
-            'SUIUSDT': 'SUIUSD',   # Возможно поддерживается
-            # Эти монеты могут не поддерживаться Kraken:
-            # 'BIGTIMEUSDT', 'ALTUSDT', 'WLDUSDT'
-            # Для них будем использовать другие коннекторы
-        }
-        
-        return symbol_mapping.get(symbol, None)
+        return _SYMBOL_MAP.get(symbol)
         
-    def _rate_limit(self):
-        """Ограничение частоты запросов"""
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
+    def _get_session(self) -> aiohttp.ClientSession:
+        """HTTP-сессия коннектора (создается лениво, если общая не передана)"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=60)
+            )
+            self._owns_session = True
+        return self.session
         
-        # Минимум 1 секунда между запросами
-        if time_since_last_request < 1:
-            time.sleep(1 - time_since_last_request)
-            
-        self.last_request_time = time.time()
+    async def _get_json(self, url: str, params: dict, timeout: float):
+        """GET-запрос с ограничением частоты: возвращает HTTP статус и разобранный JSON (None при ошибке)"""
+        async with self._sem:
+            await self._bucket.acquire()
+            async with self._get_session().get(url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.status != 200:
+                    return response.status, None
+                return response.status, orjson.loads(await response.read())
         
     def _convert_timeframe(self, timeframe: str) -> int:
         """Конвертация таймфрейма в формат Kraken (в минутах)"""
-        timeframe_mapping = {
-            '1m': 1,
-            '5m': 5,
-            '15m': 15,
-            '30m': 30,
-            '1h': 60,
-            '4h': 240,
-            '1d': 1440
+        return _TIMEFRAME_MAP.get(timeframe, 5)
+        
+    async def _fetch_ohlc(self, symbol: str, kraken_symbol: str, interval: int, since: int, min_rows: int = 1) -> pd.DataFrame:
+        """Запрос свечей OHLC начиная с since (unix-секунды), None если свечей меньше min_rows"""
+        # Подготавливаем параметры запроса
+        params = {
+            'pair': kraken_symbol,
+            'interval': interval,
+            'since': since
         }
         
-        return timeframe_mapping.get(timeframe, 5)
+        # Делаем запрос к публичному API Kraken
+        url = f"{self.base_url}/OHLC"
+        status, data = await self._get_json(url, params, 30)
         
-    async def get_historical_data(self, symbol: str, timeframe: str, limit: int = 100) -> pd.DataFrame:
-        """Получение исторических данных с RSI"""
+        if status != 200:
+            logger.error("Ошибка API Kraken: %s", status)
+            return None
+        
+        if 'error' in data and data['error']:
+            logger.error("Ошибка Kraken API: %s", data['error'])
+            return None
+            
+        if 'result' not in data or not data['result']:
+            logger.warning("Нет данных для %s", symbol)
+            return None
+            
+        # Получаем данные свечей
+        pair_data = None
+        for key, value in data['result'].items():
+            if isinstance(value, list) and key != 'last':
+                pair_data = value
+                break
+                
+        if not pair_data:
+            logger.warning("Нет данных свечей для %s", symbol)
+            return None
+            
+        # Слишком короткий ряд отбрасываем до построения DataFrame
+        if len(pair_data) < min_rows:
+            logger.warning("Недостаточно данных для %s: %s строк", symbol, len(pair_data))
+            return None
+            
+        # Разбираем свечи в числовую матрицу за один проход:
+        # [time, open, high, low, close, vwap, volume, count]
+        ohlcv = np.asarray(pair_data, dtype=np.float64)
+        
+        # Kraken отдает секунды - переводим в миллисекунды, как у остальных коннекторов
+        timestamps = (ohlcv[:, 0].astype(np.int64) * 1000).view('datetime64[ms]')
+        
+        return pd.DataFrame({
+            'open': ohlcv[:, 1],
+            'high': ohlcv[:, 2],
+            'low': ohlcv[:, 3],
+            'close': ohlcv[:, 4],
+            'volume': ohlcv[:, 6]
+        }, index=pd.DatetimeIndex(timestamps, name='timestamp', copy=False))
+        
+    async def _update_incremental(self, symbol: str, kraken_symbol: str, interval: int, state, limit: int) -> pd.DataFrame:
+        """
+        Догрузка только новых свечей (параметр since) и продолжение RSI
+        по сохраненному состоянию Уайлдера. None - нужна полная загрузка.
+        """
+        cached_df, avg_gain, avg_loss = state
+        anchor = cached_df.index[-2]
+        
+        # since на секунду раньше последней закрытой свечи, чтобы она попала в ответ
+        fresh = await self._fetch_ohlc(symbol, kraken_symbol, interval, int(anchor.timestamp()) - 1)
+        
+        # Без общей закрытой свечи склеить ряды нельзя (пропуск данных)
+        if fresh is None or anchor not in fresh.index:
+            return None
+            
+        tail = fresh.loc[fresh.index > anchor]
+        if tail.empty:
+            return None
+            
+        rsi, avg_gain, avg_loss = wilder_extend(
+            avg_gain,
+            avg_loss,
+            float(fresh.at[anchor, 'close']),
+            tail['close'].to_numpy(dtype=np.float64),
+            self.config.RSI_PERIOD
+        )
+        
+        df = pd.concat([cached_df.loc[:anchor], tail.assign(rsi=rsi)]).iloc[-len(cached_df):]
+        df.attrs['rsi_state'] = (avg_gain, avg_loss)
+        self._rsi_state[(symbol, interval)] = (df, avg_gain, avg_loss)
+        
+        logger.info("Данные для %s обновлены инкрементально (%s новых свечей)", symbol, len(tail))
+        return df.iloc[-limit:]
+        
+    async def get_candles(self, symbol: str, timeframe: str, limit: int) -> pd.DataFrame:
+        """
+        Последние limit свечей без RSI и мимо кэша ответов: формирующаяся свеча
+        всегда свежая (гибридный коннектор продолжает по ним RSI)
+        """
         try:
-            # Конвертируем символ
             kraken_symbol = self._convert_symbol_to_kraken(symbol)
-            
             if kraken_symbol is None:
-                logger.warning(f"Символ {symbol} не поддерживается Kraken")
                 return None
                 
-            # Применяем rate limiting
-            self._rate_limit()
-            
-            # Конвертируем таймфрейм
             interval = self._convert_timeframe(timeframe)
+            since = int(datetime.now().timestamp()) - (limit + 1) * interval * 60
             
-            logger.info(f"Запрашиваем данные для {kraken_symbol} ({symbol}) на {interval}m")
+            df = await self._fetch_ohlc(symbol, kraken_symbol, interval, since)
+            return None if df is None else df.iloc[-limit:]
             
-            # Подготавливаем параметры запроса
-            params = {
-                'pair': kraken_symbol,
-                'interval': interval,
-                'since': int((datetime.now() - timedelta(days=30)).timestamp())
-            }
-            
-            # Делаем запрос к публичному API Kraken
-            url = f"{self.base_url}/OHLC"
-            response = requests.get(url, params=params, timeout=30)
+        except Exception as e:
+            logger.error("Ошибка при получении свечей для %s: %s", symbol, e)
+            return None
             
-            if response.status_code != 200:
-                logger.error(f"Ошибка API Kraken: {response.status_code}")
-                return None
-                
-            data = response.json()
+    async def get_historical_data(self, symbol: str, timeframe: str, limit: int = 100) -> pd.DataFrame:
+        """Получение исторических данных с RSI (одинаковые одновременные запросы объединяются)"""
+        return await self._inflight.run(
+            ('history', symbol, timeframe, limit),
+            lambda: self._load_historical_data(symbol, timeframe, limit)
+        )
+        
+    async def _load_historical_data(self, symbol: str, timeframe: str, limit: int) -> pd.DataFrame:
+        """Получение исторических данных с RSI"""
+        try:
+            # Конвертируем символ
+            kraken_symbol = self._convert_symbol_to_kraken(symbol)
             
-            if 'error' in data and data['error']:
-                logger.error(f"Ошибка Kraken API: {data['error']}")
+            if kraken_symbol is None:
+                logger.warning("Символ %s не поддерживается Kraken", symbol)
                 return None
                 
-            if 'result' not in data or not data['result']:
-                logger.warning(f"Нет данных для {symbol}")
-                return None
+            # Повторный запрос тех же данных в пределах TTL обслуживаем из кэша
+            cache_key = (symbol, timeframe, limit)
+            cached = self._cache.get(cache_key, HISTORY_TTL.get(timeframe, 60))
+            if cached is not None:
+                return cached.copy(deep=False)
                 
-            # Получаем данные свечей
-            pair_data = None
-            for key, value in data['result'].items():
-                if isinstance(value, list) and key != 'last':
-                    pair_data = value
-                    break
-                    
-            if not pair_data:
-                logger.warning(f"Нет данных свечей для {symbol}")
-                return None
-                
-            # Создаем DataFrame
-            df = pd.DataFrame(pair_data, columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count'
-            ])
-            
-            # Конвертируем типы данных
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-            numeric_columns = ['open', 'high', 'low', 'close', 'volume']
-            df[numeric_columns] = df[numeric_columns].astype(float)
+            # Конвертируем таймфрейм
+            interval = self._convert_timeframe(timeframe)
             
-            # Устанавливаем timestamp как индекс
-            df.set_index('timestamp', inplace=True)
+            # Если состояние RSI уже известно, догружаем только новые свечи
+            state = self._rsi_state.get((symbol, interval))
+            if state is not None and len(state[0]) >= limit:
+                df = await self._update_incremental(symbol, kraken_symbol, interval, state, limit)
+                if df is not None:
+                    self._cache.set(cache_key, df.copy(deep=False))
+                    return df
             
-            # Убираем строки с NaN
-            df = df.dropna()
+            logger.info("Запрашиваем данные для %s (%s) на %sm", kraken_symbol, symbol, interval)
             
-            if len(df) < 20:
-                logger.warning(f"Недостаточно данных для {symbol}: {len(df)} строк")
+            since = int((datetime.now() - timedelta(days=30)).timestamp())
+            rsi_period = self.config.RSI_PERIOD
+            df = await self._fetch_ohlc(symbol, kraken_symbol, interval, since, min_rows=max(20, rsi_period + 1))
+            if df is None:
                 return None
                 
-            # Вычисляем RSI
-            df['rsi'] = ta.rsi(df['close'], length=self.config.RSI_PERIOD)
+            # Вычисляем RSI (TA-Lib, если установлен, иначе ядро Уайлдера из rsi_utils)
+            close = df['close'].to_numpy(dtype=np.float64)
+            if talib is not None:
+                rsi = talib.RSI(close, timeperiod=rsi_period)
+            else:
+                rsi = wilder_rsi(close, rsi_period)
             
-            # Удаляем строки с NaN значениями RSI
-            df = df.dropna(subset=['rsi'])
+            # Первые rsi_period значений RSI - NaN: отрезаем их вместе с лишними свечами
+            # и добавляем колонку RSI уже к итоговому срезу
+            start = max(rsi_period, len(close) - limit)
+            df = df.iloc[start:].assign(rsi=rsi[start:])
             
-            # Возвращаем только нужное количество свечей
-            df = df.tail(limit)
+            # Запоминаем состояние Уайлдера на последней закрытой свече
+            # (последняя свеча еще формируется) для инкрементальных обновлений
+            if len(df) >= 2:
+                avg_gain, avg_loss = wilder_state(close[:-1], rsi_period)
+                self._rsi_state[(symbol, interval)] = (df, avg_gain, avg_loss)
+                # То же состояние отдается вместе с данными (для гибридного коннектора)
+                df.attrs['rsi_state'] = (avg_gain, avg_loss)
             
-            logger.info(f"Получено {len(df)} свечей для {symbol} с RSI (последний RSI: {df['rsi'].iloc[-1]:.2f})")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Получено %s свечей для %s с RSI (последний RSI: %.2f)", len(df), symbol, df['rsi'].iloc[-1])
+            self._cache.set(cache_key, df.copy(deep=False))
             return df
             
         except Exception as e:
-            logger.error(f"Ошибка при получении данных для {symbol}: {str(e)}")
+            logger.error("Ошибка при получении данных для %s: %s", symbol, e)
             return None
             
     async def get_current_price(self, symbol: str) -> float:
+        """Получение текущей цены (одинаковые одновременные запросы объединяются)"""
+        return await self._inflight.run(('price', symbol), lambda: self._load_current_price(symbol))
+        
+    async def _load_current_price(self, symbol: str) -> float:
         """Получение текущей цены"""
         try:
             kraken_symbol = self._convert_symbol_to_kraken(symbol)
             
             if kraken_symbol is None:
-                logger.warning(f"Символ {symbol} не поддерживается Kraken")
+                logger.warning("Символ %s не поддерживается Kraken", symbol)
                 return None
                 
-            # Применяем rate limiting
-            self._rate_limit()
-            
+            cache_key = ('price', symbol)
+            cached = self._cache.get(cache_key, PRICE_TTL)
+            if cached is not None:
+                return cached
+                
             url = f"{self.base_url}/Ticker"
             params = {'pair': kraken_symbol}
             
-            response = requests.get(url, params=params, timeout=10)
+            status, data = await self._get_json(url, params, 10)
             
-            if response.status_code == 200:
-                data = response.json()
+            if status == 200:
                 if 'result' in data and data['result']:
                     for pair_name, pair_data in data['result'].items():
                         if 'c' in pair_data:  # 'c' - последняя цена
-                            return float(pair_data['c'][0])
+                            price = float(pair_data['c'][0])
+                            self._cache.set(cache_key, price)
+                            return price
                             
-            logger.warning(f"Не удалось получить цену для {symbol}")
+            logger.warning("Не удалось получить цену для %s", symbol)
             return None
             
         except Exception as e:
-            logger.error(f"Ошибка при получении цены для {symbol}: {str(e)}")
+            logger.error("Ошибка при получении цены для %s: %s", symbol, e)
             return None
             
-    def close(self):
-        """Заглушка для совместимости"""
-        logger.info("Kraken Public API коннектор закрыт")
-        pass 
\ No newline at end of file
+    async def close(self):
+        """Закрытие HTTP-сессии (общую сессию закрывает ее владелец)"""
+        if self._owns_session and self.session is not None and not self.session.closed:
+            await self.session.close()
+        logger.info("Kraken Public API коннектор закрыт") 
\ No newline at end of file
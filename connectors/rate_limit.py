@@ -0,0 +1,27 @@
+import asyncio
+import time
+
+
+class AsyncTokenBucket:
+    """Ограничение частоты запросов: rate запросов в секунду с допустимым всплеском до burst"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._lock = asyncio.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        """Ожидание права на запрос (event loop не блокируется)"""
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            # Токен резервируется сразу: при нехватке ожидающие выстраиваются в очередь
+            self._tokens -= 1
+            delay = -self._tokens / self.rate
+
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,71 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+# Время жизни исторических данных в кэше (секунды), согласовано с длительностью свечи
+HISTORY_TTL = {
+    '1m': 30,
+    '5m': 60,
+    '15m': 120,
+    '1h': 300,
+    '4h': 900,
+    '1d': 3600
+}
+
+# Время жизни текущей цены в кэше (секунды)
+PRICE_TTL = 2
+
+
+class ResponseCache:
+    """Небольшой LRU-кэш ответов API с ограниченным временем жизни записей"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, ttl: float):
+        """Значение по ключу или None, если записи нет или она устарела"""
+        item = self._data.get(key)
+        if item is None:
+            return None
+
+        stored_at, value = item
+        if time.monotonic() - stored_at >= ttl:
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        """Сохранение значения с вытеснением самой старой записи при переполнении"""
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class SingleFlight:
+    """Объединение одновременных одинаковых запросов: пока запрос выполняется, остальные ждут его результат"""
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def run(self, key, make_call):
+        """Результат make_call() - общий для всех, кто запросил key, пока запрос в полете"""
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(make_call())
+            entry = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            # Все ожидающие отменены - сам запрос больше никому не нужен
+            if entry[1] == 0 and not task.done():
+                task.cancel()
@@ -1,73 +1,52 @@
 import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import logging
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-import time
-from selenium.webdriver.common.keys import Keys
-import webbrowser
-import websocket
-import json
 
 logger = logging.getLogger(__name__)
 
+# Таймфреймы Binance
+_BINANCE_TIMEFRAME_MAP = {
+    '1m': '1m',
+    '5m': '5m',
+    '15m': '15m',
+    '30m': '30m',
+    '1h': '1h',
+    '4h': '4h',
+    '1d': '1d'
+}
+
+# Таймфреймы TradingView
+_TV_TIMEFRAME_MAP = {
+    '1m': '1',
+    '5m': '5',
+    '15m': '15',
+    '30m': '30',
+    '1h': '60',
+    '4h': '240',
+    '1d': 'D'
+}
+
 class TradingViewConnector:
     def __init__(self):
         """Инициализация коннектора TradingView"""
         self.base_url = "https://www.tradingview.com/chart"
+        # Свечи и цены берутся из публичного API Binance (у страницы графика API нет)
+        self.api_url = "https://api.binance.com/api/v3"
         self.username = None
         self.password = None
-        self.driver = None
+        
+        # Постоянная HTTP-сессия: keep-alive без нового TLS-рукопожатия на каждый запрос
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=2))
         
     def set_credentials(self, username, password):
         """Установка учетных данных"""
         self.username = username
         self.password = password
         
-    def _login(self):
-        """Вход в TradingView"""
-        try:
-            if not self.username or not self.password:
-                logger.error("Учетные данные не установлены")
-                return False
-                
-            # Инициализируем драйвер
-            options = webdriver.ChromeOptions()
-            options.add_argument('--headless')  # Запуск в фоновом режиме
-            self.driver = webdriver.Chrome(options=options)
-            
-            # Открываем страницу входа
-            self.driver.get("https://www.tradingview.com/accounts/signin/")
-            
-            # Ждем загрузки формы входа
-            username_field = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.NAME, "username"))
-            )
-            password_field = self.driver.find_element(By.NAME, "password")
-            
-            # Вводим учетные данные
-            username_field.send_keys(self.username)
-            password_field.send_keys(self.password)
-            
-            # Нажимаем кнопку входа
-            login_button = self.driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
-            login_button.click()
-            
-            # Ждем успешного входа
-            WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, ".tv-header__user-menu-button"))
-            )
-            
-            return True
-            
-        except Exception as e:
-            logger.error(f"Ошибка при входе в TradingView: {str(e)}")
-            return False
-            
     def get_historical_data(self, symbol, timeframe):
         """Получение исторических данных"""
         try:
@@ -86,87 +65,69 @@ class TradingViewConnector:
                 'limit': 500
             }
             
-            response = requests.get(f"{self.base_url}/klines", params=params)
+            response = self.session.get(f"{self.api_url}/klines", params=params)
             if response.status_code != 200:
-                print(f"Ошибка при получении данных: {response.text}")
+                logger.error("Ошибка при получении данных: %s", response.text)
                 return None
                 
             data = response.json()
             
-            # Преобразование данных в DataFrame
-            df = pd.DataFrame(data, columns=[
-                'timestamp', 'open', 'high', 'low', 'close', 'volume',
-                'close_time', 'quote_volume', 'trades', 'taker_buy_base',
-                'taker_buy_quote', 'ignore'
-            ])
-            
-            # Преобразование типов данных
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            for col in ['open', 'high', 'low', 'close', 'volume']:
-                df[col] = df[col].astype(float)
+            # Разбираем [timestamp, open, high, low, close, volume] в числовую матрицу
+            # за один проход вместо поколоночного astype
+            ohlcv = np.asarray([kline[:6] for kline in data], dtype=np.float64)
+            
+            df = pd.DataFrame({
+                'timestamp': ohlcv[:, 0].astype(np.int64).view('datetime64[ms]'),
+                'open': ohlcv[:, 1],
+                'high': ohlcv[:, 2],
+                'low': ohlcv[:, 3],
+                'close': ohlcv[:, 4],
+                'volume': ohlcv[:, 5]
+            })
                 
             return df
             
         except Exception as e:
-            print(f"Ошибка при получении данных: {e}")
+            logger.error("Ошибка при получении данных: %s", e)
             return None
             
     def get_current_price(self, symbol):
         """Получение текущей цены"""
         try:
-            response = requests.get(f"{self.base_url}/ticker/price", params={'symbol': symbol})
+            response = self.session.get(f"{self.api_url}/ticker/price", params={'symbol': symbol})
             if response.status_code != 200:
-                print(f"Ошибка при получении текущей цены: {response.text}")
+                logger.error("Ошибка при получении текущей цены: %s", response.text)
                 return None
                 
             data = response.json()
             return float(data['price'])
             
         except Exception as e:
-            print(f"Ошибка при получении текущей цены: {e}")
+            logger.error("Ошибка при получении текущей цены: %s", e)
             return None
             
     def generate_tv_link(self, symbol, timeframe):
         """Генерация ссылки на график"""
         # Преобразуем таймфрейм в формат TradingView
-        timeframe_map = {
-            '15m': '15',
-            '1h': '60',
-            '4h': '240',
-            '1d': 'D'
-        }
-        
-        tv_timeframe = timeframe_map.get(timeframe, '60')
+        tv_timeframe = self._convert_timeframe_to_tv(timeframe)
         return f"{self.base_url}/?symbol=BINANCE:{symbol}&interval={tv_timeframe}"
         
     def _convert_timeframe(self, timeframe):
         """Преобразование таймфрейма в формат Binance"""
-        timeframe_map = {
-            '1m': '1m',
-            '5m': '5m',
-            '15m': '15m',
-            '30m': '30m',
-            '1h': '1h',
-            '4h': '4h',
-            '1d': '1d'
-        }
-        return timeframe_map.get(timeframe, '1h')
+        return _BINANCE_TIMEFRAME_MAP.get(timeframe, '1h')
         
     def _convert_timeframe_to_tv(self, timeframe):
         """Преобразование таймфрейма в формат TradingView"""
-        timeframe_map = {
-            '1m': '1',
-            '5m': '5',
-            '15m': '15',
-            '30m': '30',
-            '1h': '60',
-            '4h': '240',
-            '1d': 'D'
-        }
-        return timeframe_map.get(timeframe, '60')
+        return _TV_TIMEFRAME_MAP.get(timeframe, '60')
         
     def draw_levels(self, symbol, timeframe, levels):
-        """Рисование уровней на графике"""
+        """
+        Ссылка на график с нанесенными уровнями (открывать ли ее - решает вызывающий код)
+        
+        Returns:
+            URL графика или None при ошибке. Раньше метод открывал график в браузере
+            и возвращал bool: проверка результата на истинность работает как прежде
+        """
         try:
             # Формируем URL для рисования уровней
             chart_url = self.generate_tv_link(symbol, timeframe)
@@ -175,17 +136,9 @@ class TradingViewConnector:
             levels_param = ','.join([f"{level:.2f}" for level in levels])
             chart_url += f"&drawing_tool=horizontal_line&levels={levels_param}&color=#2196F3&linewidth=2&style=1"
             
-            # Открываем график в браузере
-            webbrowser.open(chart_url)
-            
-            logger.info(f"Открыт график с уровнями: {chart_url}")
-            return True
+            logger.info("Сформирован график с уровнями: %s", chart_url)
+            return chart_url
             
         except Exception as e:
-            logger.error(f"Ошибка при рисовании уровней: {str(e)}")
-            return False
-            
-        finally:
-            if self.driver:
-                self.driver.quit()
-                self.driver = None 
\ No newline at end of file
+            logger.error("Ошибка при рисовании уровней: %s", e)
+            return None
@@ -1,65 +1,192 @@
 import asyncio
 import logging
+import numpy as np
 import pandas as pd
 import yfinance as yf
 from datetime import datetime, timedelta
-import pandas_ta as ta
+from typing import Dict, List
+from rsi_utils import wilder_rsi, wilder_state
+from .rate_limit import AsyncTokenBucket
+from .response_cache import ResponseCache, SingleFlight, HISTORY_TTL, PRICE_TTL
+
+try:
+    import talib
+except ImportError:  # TA-Lib не установлен - RSI считается ядром wilder_rsi
+    talib = None
 
 logger = logging.getLogger(__name__)
 
+# Маппинг криптовалют для Yahoo Finance (только проверенные символы)
+_SYMBOL_MAP = {
+    'BTCUSDT': 'BTC-USD',
+    'DOGEUSDT': 'DOGE-USD',
+    'PEPEUSDT': 'PEPE-USD',
+    'SUIUSDT': 'SUI-USD',
+    # Новые символы - возможно поддерживаются
+    'BIGTIMEUSDT': 'BIGTIME-USD',
+    'ALTUSDT': 'ALT-USD', 
+    'WLDUSDT': 'WLD-USD'
+}
+
+# Таймфреймы Yahoo Finance
+_TIMEFRAME_MAP = {
+    '1m': '1m',
+    '3m': '5m',  # Yahoo не поддерживает 3m, используем 5m
+    '5m': '5m',
+    '15m': '15m',
+    '30m': '30m',
+    '1h': '1h',
+    '2h': '2h',
+    '4h': '4h',
+    '6h': '6h',
+    '8h': '8h',
+    '12h': '12h',
+    '1d': '1d'
+}
+
+# Период загрузки для таймфрейма
+_PERIOD_MAP = {
+    '1m': '7d',  # Максимум 7 дней для минутных данных
+    '5m': '7d',
+    '15m': '60d',  # 60 дней для получения достаточного количества данных
+    '30m': '60d',
+    '1h': '730d',  # 2 года для часовых данных
+    '2h': '730d',
+    '4h': '730d'
+}
+
 class YahooConnector:
     def __init__(self, config):
         """Инициализация подключения к Yahoo Finance"""
         self.config = config
+        
+        # Кэш ответов API (исторические данные и цены)
+        self._cache = ResponseCache()
+        self._inflight = SingleFlight()
+        
+        # Не больше 3 одновременных запросов yfinance; лимиты Yahoo заметно мягче, чем у Kraken
+        self._sem = asyncio.Semaphore(3)
+        self._bucket = AsyncTokenBucket(rate=2.0, burst=5)
         logger.info("Yahoo Finance коннектор инициализирован")
         
+    def supports(self, symbol: str) -> bool:
+        """Может ли Yahoo Finance в принципе обслужить символ"""
+        return symbol in _SYMBOL_MAP
+        
     def _convert_symbol_to_yahoo(self, symbol: str) -> str:
         """Конвертация символа Binance в формат Yahoo Finance"""
-        # Маппинг криптовалют для Yahoo Finance (только проверенные символы)
-        symbol_mapping = {
-            'BTCUSDT': 'BTC-USD',
-            'DOGEUSDT': 'DOGE-USD',
-            'PEPEUSDT': 'PEPE-USD',
-            'SUIUSDT': 'SUI-USD',
-            # Новые символы - возможно поддерживаются
-            'BIGTIMEUSDT': 'BIGTIME-USD',
-            'ALTUSDT': 'ALT-USD', 
-            'WLDUSDT': 'WLD-USD'
-        }
-        
-        return symbol_mapping.get(symbol, None)  # Возвращаем None если символ не найден
+        return _SYMBOL_MAP.get(symbol)  # Возвращаем None если символ не найден
         
     def _convert_timeframe_to_yahoo(self, timeframe: str) -> str:
         """Конвертация таймфрейма в формат Yahoo Finance"""
-        timeframe_mapping = {
-            '1m': '1m',
-            '3m': '5m',  # Yahoo не поддерживает 3m, используем 5m
-            '5m': '5m',
-            '15m': '15m',
-            '30m': '30m',
-            '1h': '1h',
-            '2h': '2h',
-            '4h': '4h',
-            '6h': '6h',
-            '8h': '8h',
-            '12h': '12h',
-            '1d': '1d'
-        }
-        
-        return timeframe_mapping.get(timeframe, '5m')
+        return _TIMEFRAME_MAP.get(timeframe, '5m')
         
     def _get_period_for_timeframe(self, timeframe: str, limit: int) -> str:
         """Определение периода для получения данных"""
-        if timeframe in ['1m', '5m']:
-            return '7d'  # Максимум 7 дней для минутных данных
-        elif timeframe in ['15m', '30m']:
-            return '60d'  # 60 дней для получения достаточного количества данных
-        elif timeframe in ['1h', '2h', '4h']:
-            return '730d'  # 2 года для часовых данных
+        return _PERIOD_MAP.get(timeframe, 'max')  # Максимальный период для дневных данных
+            
+    async def _run_blocking(self, func, *args, **kwargs):
+        """Вызов блокирующей функции yfinance в отдельном потоке с ограничением частоты"""
+        async with self._sem:
+            await self._bucket.acquire()
+            return await asyncio.to_thread(func, *args, **kwargs)
+            
+    def _normalize_frame(self, df: pd.DataFrame, symbol: str) -> pd.DataFrame:
+        """Приведение свечей Yahoo к общему формату (None, если не хватает колонок)"""
+        # Переименовываем колонки для совместимости
+        df = df.rename(columns={
+            'Open': 'open',
+            'High': 'high', 
+            'Low': 'low',
+            'Close': 'close',
+            'Volume': 'volume'
+        })
+        
+        # Убеждаемся, что у нас есть нужные колонки
+        required_columns = ['open', 'high', 'low', 'close', 'volume']
+        for col in required_columns:
+            if col not in df.columns:
+                logger.error("Отсутствует колонка %s для %s", col, symbol)
+                return None
+        
+        # Убираем строки с NaN
+        return df.dropna()
+        
+    def _prepare_frame(self, df: pd.DataFrame, symbol: str, limit: int) -> pd.DataFrame:
+        """Приведение свечей Yahoo к общему формату и расчет RSI"""
+        rsi_period = self.config.RSI_PERIOD
+        min_rows = max(20, rsi_period + 1)  # Минимум для RSI
+        
+        # Слишком короткий ряд отбрасываем до любых преобразований
+        if len(df) < min_rows:
+            logger.warning("Недостаточно данных для %s: %s строк", symbol, len(df))
+            return None
+            
+        df = self._normalize_frame(df, symbol)
+        if df is None:
+            return None
+            
+        if len(df) < min_rows:
+            logger.warning("Недостаточно данных для %s: %s строк", symbol, len(df))
+            return None
+            
+        # Вычисляем RSI (TA-Lib, если установлен, иначе ядро Уайлдера из rsi_utils)
+        close = df['close'].to_numpy(dtype=np.float64)
+        if talib is not None:
+            rsi = talib.RSI(close, timeperiod=rsi_period)
         else:
-            return 'max'  # Максимальный период для дневных данных
+            rsi = wilder_rsi(close, rsi_period)
+        
+        # Первые rsi_period значений RSI - NaN: отрезаем их вместе с лишними свечами
+        # и добавляем колонку RSI уже к итоговому срезу
+        start = max(rsi_period, len(close) - limit)
+        df = df.iloc[start:].assign(rsi=rsi[start:])
+        # Состояние Уайлдера на последней закрытой свече (последняя еще формируется):
+        # по нему гибридный коннектор продолжает RSI на новых свечах без полной загрузки
+        df.attrs['rsi_state'] = wilder_state(close[:-1], rsi_period)
+        
+        logger.info("Получено %s свечей для %s с RSI", len(df), symbol)
+        return df
+        
+    async def get_candles(self, symbol: str, timeframe: str, limit: int) -> pd.DataFrame:
+        """
+        Последние limit свечей без RSI и мимо кэша ответов: формирующаяся свеча
+        всегда свежая (гибридный коннектор продолжает по ним RSI)
+        """
+        try:
+            yahoo_symbol = self._convert_symbol_to_yahoo(symbol)
+            if yahoo_symbol is None:
+                return None
+                
+            yahoo_timeframe = self._convert_timeframe_to_yahoo(timeframe)
+            start = datetime.now() - (limit + 1) * pd.Timedelta(yahoo_timeframe)
+            
+            df = await self._run_blocking(
+                yf.Ticker(yahoo_symbol).history,
+                start=start,
+                interval=yahoo_timeframe,
+                auto_adjust=True,
+                prepost=False
+            )
+            
+            if df.empty:
+                return None
+                
+            df = self._normalize_frame(df, symbol)
+            return None if df is None else df.iloc[-limit:]
+            
+        except Exception as e:
+            logger.error("Ошибка при получении свечей для %s: %s", symbol, e)
+            return None
             
     async def get_historical_data(self, symbol: str, timeframe: str, limit: int = 100) -> pd.DataFrame:
+        """Получение исторических данных с RSI (одинаковые одновременные запросы объединяются)"""
+        return await self._inflight.run(
+            ('history', symbol, timeframe, limit),
+            lambda: self._load_historical_data(symbol, timeframe, limit)
+        )
+        
+    async def _load_historical_data(self, symbol: str, timeframe: str, limit: int) -> pd.DataFrame:
         """Получение исторических данных с RSI"""
         try:
             # Конвертируем символ и таймфрейм
@@ -67,13 +194,20 @@ class YahooConnector:
             yahoo_timeframe = self._convert_timeframe_to_yahoo(timeframe)
             period = self._get_period_for_timeframe(timeframe, limit)
             
-            logger.info(f"Запрашиваем данные для {yahoo_symbol} на {yahoo_timeframe}")
+            # Повторный запрос тех же данных в пределах TTL обслуживаем из кэша
+            cache_key = (symbol, timeframe, limit)
+            cached = self._cache.get(cache_key, HISTORY_TTL.get(timeframe, 60))
+            if cached is not None:
+                return cached.copy(deep=False)
+                
+            logger.info("Запрашиваем данные для %s на %s", yahoo_symbol, yahoo_timeframe)
             
             # Создаем тикер
             ticker = yf.Ticker(yahoo_symbol)
             
-            # Получаем исторические данные
-            df = ticker.history(
+            # Получаем исторические данные (yfinance блокирующий - выполняем в отдельном потоке)
+            df = await self._run_blocking(
+                ticker.history,
                 period=period,
                 interval=yahoo_timeframe,
                 auto_adjust=True,
@@ -81,71 +215,115 @@ class YahooConnector:
             )
             
             if df.empty:
-                logger.warning(f"Нет данных для {yahoo_symbol}")
+                logger.warning("Нет данных для %s", yahoo_symbol)
                 return None
                 
-            # Переименовываем колонки для совместимости
-            df = df.rename(columns={
-                'Open': 'open',
-                'High': 'high', 
-                'Low': 'low',
-                'Close': 'close',
-                'Volume': 'volume'
-            })
-            
-            # Убеждаемся, что у нас есть нужные колонки
-            required_columns = ['open', 'high', 'low', 'close', 'volume']
-            for col in required_columns:
-                if col not in df.columns:
-                    logger.error(f"Отсутствует колонка {col} для {symbol}")
-                    return None
-            
-            # Убираем строки с NaN
-            df = df.dropna()
-            
-            if len(df) < 20:  # Минимум для RSI
-                logger.warning(f"Недостаточно данных для {symbol}: {len(df)} строк")
-                return None
+            df = self._prepare_frame(df, symbol, limit)
+            if df is not None:
+                self._cache.set(cache_key, df.copy(deep=False))
+            return df
+            
+        except Exception as e:
+            logger.error("Ошибка при получении данных для %s: %s", symbol, e)
+            return None
+            
+    async def get_historical_data_batch(self, symbols: List[str], timeframe: str, limit: int = 100) -> Dict[str, pd.DataFrame]:
+        """Получение исторических данных для нескольких символов одним запросом yf.download"""
+        results = {symbol: None for symbol in symbols}
+        try:
+            yahoo_symbols = {
+                self._convert_symbol_to_yahoo(symbol): symbol
+                for symbol in symbols if self.supports(symbol)
+            }
+            if not yahoo_symbols:
+                return results
                 
-            # Вычисляем RSI
-            df['rsi'] = ta.rsi(df['close'], length=self.config.RSI_PERIOD)
+            yahoo_timeframe = self._convert_timeframe_to_yahoo(timeframe)
+            period = self._get_period_for_timeframe(timeframe, limit)
+            
+            logger.info("Запрашиваем данные для %s на %s", list(yahoo_symbols), yahoo_timeframe)
             
-            # Удаляем строки с NaN значениями RSI
-            df = df.dropna(subset=['rsi'])
+            # yf.download блокирующий - выполняем его в отдельном потоке
+            data = await self._run_blocking(
+                yf.download,
+                list(yahoo_symbols),
+                period=period,
+                interval=yahoo_timeframe,
+                group_by='ticker',
+                threads=True,
+                auto_adjust=True,
+                prepost=False,
+                progress=False
+            )
             
-            # Возвращаем только нужное количество свечей
-            df = df.tail(limit)
+            if data is None or data.empty:
+                logger.warning("Нет данных для %s", list(yahoo_symbols))
+                return results
+                
+            tickers = set(data.columns.get_level_values(0)) if isinstance(data.columns, pd.MultiIndex) else set()
             
-            logger.info(f"Получено {len(df)} свечей для {symbol} с RSI")
-            return df
+            for yahoo_symbol, symbol in yahoo_symbols.items():
+                if yahoo_symbol in tickers:
+                    df = data[yahoo_symbol]
+                elif not tickers and len(yahoo_symbols) == 1:
+                    df = data
+                else:
+                    logger.warning("Нет данных для %s", yahoo_symbol)
+                    continue
+                    
+                df = self._prepare_frame(df, symbol, limit)
+                if df is not None:
+                    self._cache.set((symbol, timeframe, limit), df.copy(deep=False))
+                results[symbol] = df
+                
+            return results
             
         except Exception as e:
-            logger.error(f"Ошибка при получении данных для {symbol}: {str(e)}")
-            return None
+            logger.error("Ошибка при получении данных для %s: %s", list(symbols), e)
+            return results
+            
+    @staticmethod
+    def _fetch_price(yahoo_symbol: str):
+        """Блокирующий запрос последней цены через yfinance"""
+        ticker = yf.Ticker(yahoo_symbol)
+        
+        # Получаем последнюю цену
+        info = ticker.info
+        current_price = info.get('regularMarketPrice') or info.get('previousClose')
+        
+        if not current_price:
+            # Альтернативный способ - через быстрые данные
+            current_price = getattr(ticker.fast_info, 'last_price', None)
             
+        return current_price
+        
     async def get_current_price(self, symbol: str) -> float:
+        """Получение текущей цены (одинаковые одновременные запросы объединяются)"""
+        return await self._inflight.run(('price', symbol), lambda: self._load_current_price(symbol))
+        
+    async def _load_current_price(self, symbol: str) -> float:
         """Получение текущей цены"""
         try:
             yahoo_symbol = self._convert_symbol_to_yahoo(symbol)
-            ticker = yf.Ticker(yahoo_symbol)
-            
-            # Получаем последнюю цену
-            info = ticker.info
-            current_price = info.get('regularMarketPrice') or info.get('previousClose')
             
-            if current_price:
-                return float(current_price)
+            cache_key = ('price', symbol)
+            cached = self._cache.get(cache_key, PRICE_TTL)
+            if cached is not None:
+                return cached
                 
-            # Альтернативный способ - через быстрые данные
-            fast_info = ticker.fast_info
-            if hasattr(fast_info, 'last_price'):
-                return float(fast_info.last_price)
+            # yfinance блокирующий - выполняем запрос в отдельном потоке
+            current_price = await self._run_blocking(self._fetch_price, yahoo_symbol)
+                
+            if current_price:
+                price = float(current_price)
+                self._cache.set(cache_key, price)
+                return price
                 
-            logger.warning(f"Не удалось получить цену для {symbol}")
+            logger.warning("Не удалось получить цену для %s", symbol)
             return None
             
         except Exception as e:
-            logger.error(f"Ошибка при получении цены для {symbol}: {str(e)}")
+            logger.error("Ошибка при получении цены для %s: %s", symbol, e)
             return None
             
     def close(self):
@@ -1,18 +1,95 @@
+import calendar
 import sqlite3
+import threading
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
 import logging
-from datetime import datetime
-from typing import List, Dict, Optional
+import numpy as np
+import orjson
+import pandas as pd
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Iterator, Optional
 from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
+# Ошибки драйверов обеих поддерживаемых баз
+_DB_ERRORS = (sqlite3.Error, psycopg2.Error)
+
+# Запросы фиксированного вида, которые PostgreSQL разбирает один раз на соединение
+# (параметры - ?, для PREPARE заменяются на $1, $2, ...)
+_SQL_USER_STATUS = 'SELECT status FROM telegram_users WHERE user_id = ?'
+_SQL_UPDATE_USER_STATUS = '''
+    UPDATE telegram_users 
+    SET status = ?,
+        approved_at = CASE WHEN ? = 'approved' THEN CURRENT_TIMESTAMP ELSE NULL END
+    WHERE user_id = ?
+'''
+_SQL_DELETE_USER = 'DELETE FROM telegram_users WHERE user_id = ?'
+# Проверка дубля идет по уникальному индексу idx_sig_unique (symbol, timeframe, signal_type, timestamp)
+_SQL_HAS_RECENT_SIGNAL = '''
+    SELECT 1 FROM rsi_signals
+    WHERE symbol = ? AND timeframe = ? AND signal_type = ? AND timestamp > ? AND timestamp < ?
+    LIMIT 1
+'''
+
+# UPSERT, а не INSERT OR REPLACE: замена удаляла строку и сбрасывала status и approved_at
+_SQL_UPSERT_USER = '''
+    INSERT INTO telegram_users 
+    (user_id, username, first_name, last_name, last_activity)
+    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT (user_id) DO UPDATE SET
+    username = excluded.username,
+    first_name = excluded.first_name,
+    last_name = excluded.last_name,
+    last_activity = CURRENT_TIMESTAMP
+'''
+
+
+class _PgConnection(psycopg2.extensions.connection):
+    """Соединение PostgreSQL, которое помнит подготовленные на нем выражения"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
 class RSIDatabase:
     def __init__(self, db_url: str):
         """Инициализация базы данных (PostgreSQL или SQLite)"""
         self.db_url = db_url
         self.db_type = self._detect_db_type(db_url)
+        
+        if db_url.startswith('postgres://'):
+            # Railway использует postgres://, но psycopg2 требует postgresql://
+            self.db_url = db_url.replace('postgres://', 'postgresql://', 1)
+        
+        # SQLite: одно соединение на весь процесс, доступ к нему сериализуется блокировкой
+        self._lock = threading.Lock()
+        self._conn = self._get_connection() if self.db_type == 'sqlite' else None
+        
+        # PostgreSQL: пул постоянных соединений (создается при первом запросе)
+        self._pool = None
+        
+        # Стиль параметров драйвера и готовые тексты выборок сигналов
+        # для всех сочетаний фильтров (см. _signals_query)
+        self._ph = "%s" if self.db_type == 'postgresql' else "?"
+        self._signals_sql = [self._build_signals_sql(mask) for mask in range(16)]
+        
+        # Кэш редко меняющихся данных: читаются на каждое сообщение, меняются только
+        # через методы этого класса, которые и сбрасывают кэш
+        self._settings_cache = None
+        self._status_cache = {}
+        self._approved_users_cache = None
+        
+        # Поколение кэша растет при каждом сбросе: чтение, начатое до записи,
+        # не положит в кэш устаревший результат после ее фиксации
+        self._cache_lock = threading.Lock()
+        self._cache_generation = 0
+        
         self.init_database()
         
     def _detect_db_type(self, db_url: str) -> str:
@@ -25,577 +102,1035 @@ class RSIDatabase:
     def _get_connection(self):
         """Получение соединения с базой данных"""
         if self.db_type == 'postgresql':
-            # Парсинг DATABASE_URL для PostgreSQL
-            if self.db_url.startswith('postgres://'):
-                # Railway использует postgres://, но psycopg2 требует postgresql://
-                self.db_url = self.db_url.replace('postgres://', 'postgresql://', 1)
-            return psycopg2.connect(self.db_url)
+            return self._get_pool().getconn()
         else:
             # SQLite для локальной разработки
             db_path = self.db_url.replace('sqlite:///', '')
-            return sqlite3.connect(db_path)
+            # Кэш подготовленных выражений с запасом на все запросы модуля
+            conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            # Размер страницы применяется только к новой базе (до создания первой таблицы)
+            conn.execute('PRAGMA page_size=8192')
+            # Тоже только для новой базы: место после удаления старых сигналов возвращается по частям
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            if db_path != ':memory:':
+                conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA busy_timeout=30000')  # ждать освобождения базы вместо ошибки database is locked
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-65536')  # 64 МБ кэша страниц
+            conn.execute('PRAGMA mmap_size=268435456')  # чтение через mmap до 256 МБ
+            return conn
+            
+    def _get_pool(self) -> psycopg2.pool.ThreadedConnectionPool:
+        """Пул соединений PostgreSQL: без TCP/TLS-рукопожатия и авторизации на каждый запрос"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = psycopg2.pool.ThreadedConnectionPool(
+                    2, 10, self.db_url, connection_factory=_PgConnection
+                )
+            return self._pool
+            
+    @contextmanager
+    def _connection(self):
+        """
+        Соединение с базой данных на время одной операции.
+        
+        Для PostgreSQL соединение берется из пула и возвращается в него, для SQLite
+        выдается общее постоянное соединение. Незафиксированные изменения откатываются.
+        """
+        if self.db_type == 'postgresql':
+            conn = self._get_connection()
+            try:
+                yield conn
+            finally:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+                # Разорванное соединение закрывается, а не возвращается в пул
+                self._get_pool().putconn(conn, close=bool(conn.closed))
+        else:
+            with self._lock:
+                try:
+                    yield self._conn
+                finally:
+                    if self._conn.in_transaction:
+                        self._conn.rollback()
+                        
+    def _invalidate_settings_cache(self):
+        """Сброс кэша настроек после их изменения"""
+        with self._cache_lock:
+            self._cache_generation += 1
+            self._settings_cache = None
+            
+    def _invalidate_user_caches(self, user_id: int = None):
+        """Сброс кэшей пользователя Telegram после изменения его записи (без user_id - всех)"""
+        with self._cache_lock:
+            self._cache_generation += 1
+            if user_id is None:
+                self._status_cache.clear()
+            else:
+                self._status_cache.pop(user_id, None)
+            self._approved_users_cache = None
+            
+    @contextmanager
+    def transaction(self):
+        """
+        Курсор для нескольких связанных записей в одной транзакции.
+        
+        Фиксация - при выходе из блока без ошибки, при исключении изменения откатываются.
+        """
+        with self._connection() as conn:
+            yield conn.cursor()
+            conn.commit()
+            
+    def optimize(self):
+        """
+        Периодическое обслуживание: обновление статистики планировщика
+        (ANALYZE в PostgreSQL, PRAGMA optimize в SQLite) и сброс WAL SQLite
+        """
+        try:
+            with self._connection() as conn:
+                if self.db_type == 'postgresql':
+                    cursor = conn.cursor()
+                    cursor.execute('ANALYZE rsi_signals')
+                    cursor.execute('ANALYZE telegram_users')
+                    conn.commit()
+                else:
+                    conn.execute('PRAGMA optimize')
+                    conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при обслуживании базы данных: %s", e)
+            
+    def purge_old_signals(self, days: int = 30) -> int:
+        """
+        Удаление сигналов старше days дней, чтобы таблица и ее индексы не росли бесконечно
+        
+        Returns:
+            Количество удаленных сигналов
+        """
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                
+                cutoff = self._to_db_timestamp(self._utcnow() - timedelta(days=days))
+                cursor.execute('DELETE FROM rsi_signals WHERE timestamp < ' + self._ph, (cutoff,))
+                deleted = cursor.rowcount
+                conn.commit()
+                
+                # Освободившиеся страницы возвращаются файлу (при auto_vacuum=INCREMENTAL)
+                if self.db_type == 'sqlite' and deleted:
+                    conn.execute('PRAGMA incremental_vacuum')
+                    
+                logger.info("Удалено старых сигналов: %s", deleted)
+                return deleted
+            
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при удалении старых сигналов: %s", e)
+            return 0
+            
+    def close(self):
+        """Закрытие постоянных соединений (при закрытии SQLite WAL сбрасывается в основной файл)"""
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+            
+        if self._conn is not None:
+            with self._lock:
+                try:
+                    self._conn.execute('PRAGMA optimize')
+                except _DB_ERRORS as e:
+                    logger.error("Ошибка при обслуживании базы данных: %s", e)
+                finally:
+                    self._conn.close()
+                    self._conn = None
+                
+    def _execute_prepared(self, conn, cursor, name: str, sql: str, params: tuple):
+        """Выполнение запроса фиксированного вида (в PostgreSQL - через PREPARE/EXECUTE)"""
+        if self.db_type != 'postgresql':
+            # sqlite3 сам держит разобранные выражения в кэше соединения
+            cursor.execute(sql, params)
+            return
+            
+        if name not in conn.prepared:
+            parts = sql.split('?')
+            pg_sql = parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], 1))
+            cursor.execute(f'PREPARE {name} AS {pg_sql}')
+            conn.prepared.add(name)
+            
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+        
+    def _dict_cursor(self, conn):
+        """Курсор, строки которого превращаются в dict по именам колонок"""
+        if self.db_type == 'postgresql':
+            return conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        return conn.cursor()
+        
+    def _to_db_timestamp(self, timestamp):
+        """Время сигнала для записи: unix-секунды UTC (SQLite) или datetime (PostgreSQL)"""
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+            
+        if self.db_type == 'postgresql':
+            return timestamp.to_pydatetime() if hasattr(timestamp, 'to_pydatetime') else timestamp
+            
+        # pd.Timestamp хранит наносекунды с эпохи, наивный datetime считаем UTC
+        if hasattr(timestamp, 'value'):
+            return timestamp.value // 10**9
+        return calendar.timegm(timestamp.utctimetuple())
+        
+    def _to_db_timestamps(self, timestamps: List) -> List:
+        """Время пачки сигналов для записи: для SQLite - одним векторным преобразованием"""
+        if self.db_type == 'sqlite':
+            try:
+                # values у DatetimeIndex - datetime64 в UTC, в том числе для времени с часовым поясом
+                index = pd.to_datetime(list(timestamps))
+                return index.values.astype('datetime64[s]').astype(np.int64).tolist()
+            except (TypeError, ValueError):
+                pass  # смешанные часовые пояса и т.п. - преобразуем по одному
+                
+        return [self._to_db_timestamp(timestamp) for timestamp in timestamps]
+        
+    @staticmethod
+    def _utcnow() -> datetime:
+        """Текущее время в виде наивного datetime UTC (в таком виде хранится время сигналов)"""
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+        
+    def _from_db_timestamp(self, value):
+        """
+        Время сигнала из базы в виде наивного datetime UTC (как у PostgreSQL)
+        
+        Читатели сигналов получают время только в этом виде и не проверяют тип.
+        """
+        if isinstance(value, int):
+            return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+        if isinstance(value, str):
+            # Текстовое время строк, записанных до перехода SQLite на unix-секунды
+            return datetime.fromisoformat(value)
+        return value
         
     def init_database(self):
         """Создание таблиц в базе данных"""
         try:
-            conn = self._get_connection()
+            with self._connection() as conn:
             
-            if self.db_type == 'postgresql':
-                cursor = conn.cursor()
+                if self.db_type == 'postgresql':
+                    cursor = conn.cursor()
                 
-                # Таблица для RSI сигналов (PostgreSQL)
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS rsi_signals (
-                        id SERIAL PRIMARY KEY,
-                        symbol VARCHAR(20) NOT NULL,
-                        timeframe VARCHAR(10) NOT NULL,
-                        signal_type VARCHAR(20) NOT NULL,
-                        rsi_value REAL NOT NULL,
-                        price REAL NOT NULL,
-                        timestamp TIMESTAMP NOT NULL,
-                        previous_rsi REAL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
+                    # Таблица для RSI сигналов (PostgreSQL)
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS rsi_signals (
+                            id SERIAL PRIMARY KEY,
+                            symbol VARCHAR(20) NOT NULL,
+                            timeframe VARCHAR(10) NOT NULL,
+                            signal_type VARCHAR(20) NOT NULL,
+                            rsi_value REAL NOT NULL,
+                            price REAL NOT NULL,
+                            timestamp TIMESTAMP NOT NULL,
+                            previous_rsi REAL,
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        )
+                    ''')
                 
-                # Таблица для настроек пользователя (PostgreSQL)
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS user_settings (
-                        id INTEGER PRIMARY KEY,
-                        symbols TEXT NOT NULL,
-                        timeframe VARCHAR(10) NOT NULL,
-                        rsi_oversold INTEGER DEFAULT 30,
-                        rsi_overbought INTEGER DEFAULT 70,
-                        notifications_enabled BOOLEAN DEFAULT TRUE
-                    )
-                ''')
+                    # Таблица для настроек пользователя (PostgreSQL)
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS user_settings (
+                            id INTEGER PRIMARY KEY,
+                            symbols TEXT NOT NULL,
+                            timeframe VARCHAR(10) NOT NULL,
+                            rsi_oversold INTEGER DEFAULT 30,
+                            rsi_overbought INTEGER DEFAULT 70,
+                            notifications_enabled BOOLEAN DEFAULT TRUE
+                        )
+                    ''')
                 
-                # Таблица для пользователей Telegram (PostgreSQL)
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS telegram_users (
-                        id SERIAL PRIMARY KEY,
-                        user_id BIGINT UNIQUE NOT NULL,
-                        username VARCHAR(100),
-                        first_name VARCHAR(100),
-                        last_name VARCHAR(100),
-                        status VARCHAR(20) DEFAULT 'pending',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        approved_at TIMESTAMP,
-                        last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
+                    # Символы из настроек - отдельными строками в порядке выбора (PostgreSQL)
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS user_symbols (
+                            settings_id INTEGER NOT NULL,
+                            position INTEGER NOT NULL,
+                            symbol VARCHAR(20) NOT NULL,
+                            PRIMARY KEY (settings_id, symbol)
+                        )
+                    ''')
+                    
+                    cursor.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_user_symbols_symbol
+                        ON user_symbols(symbol)
+                    ''')
+                    
+                    # Таблица для пользователей Telegram (PostgreSQL)
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS telegram_users (
+                            id SERIAL PRIMARY KEY,
+                            user_id BIGINT UNIQUE NOT NULL,
+                            username VARCHAR(100),
+                            first_name VARCHAR(100),
+                            last_name VARCHAR(100),
+                            status VARCHAR(20) DEFAULT 'pending',
+                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            approved_at TIMESTAMP,
+                            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        )
+                    ''')
                 
-                # Создаем индексы для быстрого поиска (PostgreSQL)
-                cursor.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_symbol_timeframe 
-                    ON rsi_signals(symbol, timeframe)
-                ''')
+                    # Один сигнал на свечу: накопившиеся дубли убираются один раз,
+                    # перед созданием уникального индекса, который запрещает новые (PostgreSQL)
+                    cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = 'idx_sig_unique'")
+                    if cursor.fetchone() is None:
+                        cursor.execute('''
+                            DELETE FROM rsi_signals
+                            WHERE id NOT IN (
+                                SELECT MIN(id) FROM rsi_signals
+                                GROUP BY symbol, timeframe, signal_type, timestamp
+                            )
+                        ''')
+                    
+                    cursor.execute('''
+                        CREATE UNIQUE INDEX IF NOT EXISTS idx_sig_unique
+                        ON rsi_signals(symbol, timeframe, signal_type, timestamp)
+                    ''')
+                    
+                    # Индекс по (symbol, timeframe) перекрывается уникальным
+                    cursor.execute('DROP INDEX IF EXISTS idx_symbol_timeframe')
                 
-                cursor.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_timestamp 
-                    ON rsi_signals(timestamp)
-                ''')
+                    # Покрывающие индексы для выборок последних сигналов
+                    # (запросы читают только индекс, без обращения к таблице)
+                    cursor.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_sig_ts_cov
+                        ON rsi_signals(timestamp DESC)
+                        INCLUDE (symbol, timeframe, signal_type, rsi_value, price, previous_rsi)
+                    ''')
+                    
+                    cursor.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_sig_sym_ts
+                        ON rsi_signals(symbol, timestamp DESC)
+                        INCLUDE (timeframe, signal_type, rsi_value, price, previous_rsi)
+                    ''')
+                    
+                    # Проверка недавних сигналов анализатором фильтрует по символу и таймфрейму
+                    cursor.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_sig_sym_tf_ts
+                        ON rsi_signals(symbol, timeframe, timestamp DESC)
+                        INCLUDE (signal_type, rsi_value, price, previous_rsi)
+                    ''')
+                    
+                    # Индекс по одному timestamp перекрывается покрывающим
+                    cursor.execute('DROP INDEX IF EXISTS idx_timestamp')
+                    
+                    # Рассылка выбирает одобренных пользователей: частичный индекс только по ним
+                    # отвечает на запрос, не трогая таблицу (индекс по всем статусам не нужен)
+                    cursor.execute('DROP INDEX IF EXISTS idx_telegram_status')
+                    cursor.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_users_approved
+                        ON telegram_users(user_id) INCLUDE (username, first_name, last_name)
+                        WHERE status = 'approved'
+                    ''')
                 
-            else:
-                # SQLite для локальной разработки
-                cursor = conn.cursor()
+                else:
+                    # SQLite для локальной разработки
+                    cursor = conn.cursor()
                 
-                # Таблица для RSI сигналов (SQLite)
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS rsi_signals (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        symbol TEXT NOT NULL,
-                        timeframe TEXT NOT NULL,
-                        signal_type TEXT NOT NULL,
-                        rsi_value REAL NOT NULL,
-                        price REAL NOT NULL,
-                        timestamp DATETIME NOT NULL,
-                        previous_rsi REAL,
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
+                    # Таблица для RSI сигналов (SQLite)
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS rsi_signals (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            symbol TEXT NOT NULL,
+                            timeframe TEXT NOT NULL,
+                            signal_type TEXT NOT NULL,
+                            rsi_value REAL NOT NULL,
+                            price REAL NOT NULL,
+                            timestamp INTEGER NOT NULL,
+                            previous_rsi REAL,
+                            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                        )
+                    ''')
                 
-                # Добавляем поле previous_rsi если его нет
-                try:
-                    cursor.execute('ALTER TABLE rsi_signals ADD COLUMN previous_rsi REAL')
-                except sqlite3.OperationalError:
-                    pass
+                    # Разовые миграции старых баз (версия схемы хранится в user_version)
+                    schema_version = cursor.execute('PRAGMA user_version').fetchone()[0]
+                    if schema_version < 1:
+                        # Добавляем поле previous_rsi если его нет
+                        columns = {row[1] for row in cursor.execute('PRAGMA table_info(rsi_signals)')}
+                        if 'previous_rsi' not in columns:
+                            cursor.execute('ALTER TABLE rsi_signals ADD COLUMN previous_rsi REAL')
+                            
+                        # Старые записи хранили timestamp строкой - переводим в unix-секунды
+                        cursor.execute('''
+                            UPDATE rsi_signals
+                            SET timestamp = CAST(strftime('%s', timestamp) AS INTEGER)
+                            WHERE typeof(timestamp) = 'text'
+                        ''')
+                        
+                        cursor.execute('PRAGMA user_version = 1')
+                        
+                    if schema_version < 2:
+                        # Убираем накопившиеся дубли сигналов до создания уникального индекса
+                        cursor.execute('''
+                            DELETE FROM rsi_signals
+                            WHERE id NOT IN (
+                                SELECT MIN(id) FROM rsi_signals
+                                GROUP BY symbol, timeframe, signal_type, timestamp
+                            )
+                        ''')
+                        
+                        cursor.execute('PRAGMA user_version = 2')
                 
-                # Таблица для настроек пользователя (SQLite)
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS user_settings (
-                        id INTEGER PRIMARY KEY,
-                        symbols TEXT NOT NULL,
-                        timeframe TEXT NOT NULL,
-                        rsi_oversold INTEGER DEFAULT 30,
-                        rsi_overbought INTEGER DEFAULT 70,
-                        notifications_enabled BOOLEAN DEFAULT 1
-                    )
-                ''')
+                    # Таблица для настроек пользователя (SQLite)
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS user_settings (
+                            id INTEGER PRIMARY KEY,
+                            symbols TEXT NOT NULL,
+                            timeframe TEXT NOT NULL,
+                            rsi_oversold INTEGER DEFAULT 30,
+                            rsi_overbought INTEGER DEFAULT 70,
+                            notifications_enabled BOOLEAN DEFAULT 1
+                        )
+                    ''')
                 
-                # Таблица для пользователей Telegram (SQLite)
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS telegram_users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER UNIQUE NOT NULL,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        status TEXT DEFAULT 'pending',
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        approved_at DATETIME,
-                        last_activity DATETIME DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
+                    # Символы из настроек - отдельными строками в порядке выбора (SQLite)
+                    # WITHOUT ROWID: строки лежат прямо в B-дереве составного ключа
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS user_symbols (
+                            settings_id INTEGER NOT NULL,
+                            position INTEGER NOT NULL,
+                            symbol TEXT NOT NULL,
+                            PRIMARY KEY (settings_id, symbol)
+                        ) WITHOUT ROWID
+                    ''')
+                    
+                    cursor.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_user_symbols_symbol
+                        ON user_symbols(symbol)
+                    ''')
+                    
+                    # Таблица для пользователей Telegram (SQLite)
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS telegram_users (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            user_id INTEGER UNIQUE NOT NULL,
+                            username TEXT,
+                            first_name TEXT,
+                            last_name TEXT,
+                            status TEXT DEFAULT 'pending',
+                            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                            approved_at DATETIME,
+                            last_activity DATETIME DEFAULT CURRENT_TIMESTAMP
+                        )
+                    ''')
                 
-                # Создаем индексы для быстрого поиска (SQLite)
-                cursor.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_symbol_timeframe 
-                    ON rsi_signals(symbol, timeframe)
-                ''')
+                    # Один сигнал на свечу: уникальный индекс запрещает новые дубли (SQLite)
+                    cursor.execute('''
+                        CREATE UNIQUE INDEX IF NOT EXISTS idx_sig_unique
+                        ON rsi_signals(symbol, timeframe, signal_type, timestamp)
+                    ''')
+                    
+                    # Индекс по (symbol, timeframe) перекрывается уникальным
+                    cursor.execute('DROP INDEX IF EXISTS idx_symbol_timeframe')
                 
-                cursor.execute('''
-                    CREATE INDEX IF NOT EXISTS idx_timestamp 
-                    ON rsi_signals(timestamp)
-                ''')
-            
-            conn.commit()
-            conn.close()
-            logger.info(f"База данных ({self.db_type}) инициализирована")
+                    # Покрывающие индексы для выборок последних сигналов
+                    # (SQLite не поддерживает INCLUDE - колонки добавлены в ключ)
+                    cursor.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_sig_ts_cov
+                        ON rsi_signals(timestamp DESC, symbol, timeframe, signal_type, rsi_value, price, previous_rsi)
+                    ''')
+                    
+                    cursor.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_sig_sym_ts
+                        ON rsi_signals(symbol, timestamp DESC, timeframe, signal_type, rsi_value, price, previous_rsi)
+                    ''')
+                    
+                    # Проверка недавних сигналов анализатором фильтрует по символу и таймфрейму
+                    cursor.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_sig_sym_tf_ts
+                        ON rsi_signals(symbol, timeframe, timestamp DESC, signal_type, rsi_value, price, previous_rsi)
+                    ''')
+                    
+                    # Индекс по одному timestamp перекрывается покрывающим
+                    cursor.execute('DROP INDEX IF EXISTS idx_timestamp')
+                    
+                    # Рассылка выбирает одобренных пользователей: частичный индекс только по ним
+                    # отвечает на запрос, не трогая таблицу (индекс по всем статусам не нужен)
+                    cursor.execute('DROP INDEX IF EXISTS idx_telegram_status')
+                    cursor.execute('''
+                        CREATE INDEX IF NOT EXISTS idx_users_approved
+                        ON telegram_users(user_id, username, first_name, last_name)
+                        WHERE status = 'approved'
+                    ''')
+                    
+                # Настройки, сохраненные до появления user_symbols, хранили символы только в JSON
+                cursor.execute('SELECT COUNT(*) FROM user_symbols')
+                if cursor.fetchone()[0] == 0:
+                    cursor.execute('SELECT symbols FROM user_settings WHERE id = 1')
+                    row = cursor.fetchone()
+                    if row:
+                        self._write_symbols(cursor, orjson.loads(row[0]))
+                
+                conn.commit()
+                
+            logger.info("База данных (%s) инициализирована", self.db_type)
             
             # Создаем дефолтные настройки если их нет
             self._create_default_settings()
             
-        except Exception as e:
-            logger.error(f"Ошибка при инициализации базы данных: {str(e)}")
+            # Статистика для новых индексов и таблиц, не дожидаясь первого обслуживания
+            self.optimize()
+            
+        except _DB_ERRORS + (ValueError,) as e:
+            logger.error("Ошибка при инициализации базы данных: %s", e)
             
     def _create_default_settings(self):
         """Создание дефолтных настроек пользователя"""
         try:
-            # Проверяем, есть ли уже настройки
-            if self.get_user_settings() is None:
-                # Создаем дефолтные настройки
-                default_symbols = ["BTCUSDT", "DOGEUSDT", "PEPEUSDT", "SUIUSDT", "BIGTIMEUSDT", "ALTUSDT", "WLDUSDT"]
-                self.save_user_settings(
-                    symbols=default_symbols,
-                    timeframe="5m",
-                    rsi_oversold=30,
-                    rsi_overbought=70
-                )
-                logger.info("Созданы дефолтные настройки пользователя")
-        except Exception as e:
-            logger.error(f"Ошибка при создании дефолтных настроек: {str(e)}")
+            default_symbols = ["BTCUSDT", "DOGEUSDT", "PEPEUSDT", "SUIUSDT", "BIGTIMEUSDT", "ALTUSDT", "WLDUSDT"]
+            
+            # Проверка и создание - одна вставка в одной транзакции с символами
+            with self.transaction() as cursor:
+                cursor.execute(f'''
+                    INSERT INTO user_settings
+                    (id, symbols, timeframe, rsi_oversold, rsi_overbought)
+                    VALUES (1, {self._ph}, '5m', 30, 70)
+                    ON CONFLICT (id) DO NOTHING
+                ''', (orjson.dumps(default_symbols).decode(),))
+                
+                if cursor.rowcount > 0:
+                    self._write_symbols(cursor, default_symbols)
+                    logger.info("Созданы дефолтные настройки пользователя")
+                    
+            self._invalidate_settings_cache()
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при создании дефолтных настроек: %s", e)
             
     def add_signal(self, symbol: str, timeframe: str, signal_type: str, 
                    rsi_value: float, price: float, timestamp, previous_rsi: float = None) -> bool:
-        """Добавление нового сигнала"""
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+        """Добавление нового сигнала (ошибки обрабатывает add_signals)"""
+        added = self.add_signals([{
+            'symbol': symbol,
+            'timeframe': timeframe,
+            'signal_type': signal_type,
+            'rsi_value': rsi_value,
+            'price': price,
+            'timestamp': timestamp,
+            'previous_rsi': previous_rsi
+        }]) == 1
+        
+        if added:
+            # Ленивое форматирование: строка собирается, только если INFO включен
+            logger.info("Добавлен сигнал: %s %s RSI=%s->%.2f", symbol, signal_type, previous_rsi, rsi_value)
+        return added
             
-            # Конвертируем timestamp в строку если нужно
-            if hasattr(timestamp, 'strftime'):
-                timestamp_str = timestamp.strftime('%Y-%m-%d %H:%M:%S')
-            else:
-                timestamp_str = str(timestamp)
+    def add_signals(self, signals: List[Dict]) -> int:
+        """Добавление нескольких сигналов одной транзакцией (возвращает число новых)"""
+        if not signals:
+            return 0
             
-            if self.db_type == 'postgresql':
-                cursor.execute('''
-                    INSERT INTO rsi_signals 
-                    (symbol, timeframe, signal_type, rsi_value, price, timestamp, previous_rsi)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                ''', (symbol, timeframe, signal_type, rsi_value, price, timestamp_str, previous_rsi))
-            else:
-                cursor.execute('''
-                    INSERT INTO rsi_signals 
-                    (symbol, timeframe, signal_type, rsi_value, price, timestamp, previous_rsi)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (symbol, timeframe, signal_type, rsi_value, price, timestamp_str, previous_rsi))
+        try:
+            timestamps = self._to_db_timestamps([signal['timestamp'] for signal in signals])
+            rows = [
+                (
+                    signal['symbol'],
+                    signal['timeframe'],
+                    signal['signal_type'],
+                    signal['rsi_value'],
+                    signal['price'],
+                    timestamp,
+                    signal.get('previous_rsi')
+                )
+                for signal, timestamp in zip(signals, timestamps)
+            ]
             
-            conn.commit()
-            conn.close()
-            logger.info(f"Добавлен сигнал: {symbol} {signal_type} RSI={previous_rsi:.2f}->{rsi_value:.2f}")
-            return True
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                
+                if self.db_type == 'postgresql':
+                    # Один многострочный INSERT на страницу вместо запроса на каждую строку;
+                    # RETURNING считает только действительно добавленные строки
+                    added = len(psycopg2.extras.execute_values(cursor, '''
+                        INSERT INTO rsi_signals 
+                        (symbol, timeframe, signal_type, rsi_value, price, timestamp, previous_rsi)
+                        VALUES %s
+                        ON CONFLICT (symbol, timeframe, signal_type, timestamp) DO NOTHING
+                        RETURNING 1
+                    ''', rows, page_size=500, fetch=True))
+                else:
+                    cursor.executemany('''
+                        INSERT OR IGNORE INTO rsi_signals 
+                        (symbol, timeframe, signal_type, rsi_value, price, timestamp, previous_rsi)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', rows)
+                    added = cursor.rowcount
+                
+                conn.commit()
+                
+                # Уже сохраненные сигналы пропускаются и не учитываются
+                return added
             
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении сигнала: {str(e)}")
-            return False
+        except _DB_ERRORS + (KeyError, TypeError, ValueError) as e:
+            logger.error("Ошибка при добавлении сигналов: %s", e)
+            return 0
             
-    def get_recent_signals(self, symbol: str = None, timeframe: str = None, hours_back: float = None, limit: int = 100) -> List[Dict]:
-        """Получение последних сигналов с опциональной фильтрацией"""
+    def _build_signals_sql(self, mask: int):
+        """
+        Тексты выборки сигналов для набора фильтров mask
+        
+        Биты mask: 1 - symbol, 2 - timeframe, 4 - hours_back, 8 - before.
+        Возвращает (страница с LIMIT, дочитывание сигналов с тем же временем, поток без LIMIT).
+        """
+        ph = self._ph
+        conditions = []
+        
+        if mask & 1:
+            conditions.append("symbol = " + ph)
+        if mask & 2:
+            conditions.append("timeframe = " + ph)
+        if mask & 4:
+            conditions.append("timestamp >= " + ph)
+        if mask & 8:
+            conditions.append("timestamp < " + ph)
+            
+        sql_query = '''
+            SELECT symbol, timeframe, signal_type, rsi_value, price, timestamp, previous_rsi
+            FROM rsi_signals
+        '''
+        if conditions:
+            sql_query += " WHERE " + " AND ".join(conditions)
+            
+        return (
+            sql_query + " ORDER BY timestamp DESC LIMIT " + ph,
+            sql_query + (" AND " if conditions else " WHERE ") + "timestamp = " + ph,
+            sql_query + " ORDER BY timestamp DESC",
+        )
+        
+    def _signals_query(self, symbol: str = None, timeframe: str = None, hours_back: float = None, before=None):
+        """Готовые тексты выборки сигналов (см. _build_signals_sql) и параметры фильтров"""
+        mask = 0
+        params = []
+        
+        if symbol:
+            mask |= 1
+            params.append(symbol)
+        if timeframe:
+            mask |= 2
+            params.append(timeframe)
+        if hours_back is not None:
+            # Граница считается заранее: планировщик видит сравнение с константой
+            mask |= 4
+            params.append(self._to_db_timestamp(self._utcnow() - timedelta(hours=hours_back)))
+        if before is not None:
+            mask |= 8
+            params.append(self._to_db_timestamp(before))
+            
+        return self._signals_sql[mask], params
+        
+    def get_recent_signals(self, symbol: str = None, timeframe: str = None, hours_back: float = None,
+                           limit: int = 100, before=None) -> List[Dict]:
+        """
+        Получение последних сигналов с опциональной фильтрацией
+        
+        Для постраничного вывода before - время последнего сигнала предыдущей
+        страницы: выборка идет по индексу с этого места, без пропуска первых страниц.
+        Большие выборки лучше читать через iter_recent_signals.
+        """
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = self._dict_cursor(conn)
+                (page_sql, tie_sql, _), params = self._signals_query(symbol, timeframe, hours_back, before)
+                
+                cursor.execute(page_sql, params + [limit])
+                rows = cursor.fetchall()
+                
+                # Сигналы одной свечи имеют одинаковое время: дочитываем все сигналы со временем
+                # последней строки, чтобы следующая страница (before=это время) ничего не пропустила
+                if rows and len(rows) == limit:
+                    last_timestamp = rows[-1]['timestamp']
+                    cursor.execute(tie_sql, params + [last_timestamp])
+                    rows = [row for row in rows if row['timestamp'] != last_timestamp] + cursor.fetchall()
+                
+                signals = [dict(row) for row in rows]
+                for signal in signals:
+                    signal['timestamp'] = self._from_db_timestamp(signal['timestamp'])
             
-            # Базовый SQL запрос
-            sql_base = '''
-                SELECT symbol, timeframe, signal_type, rsi_value, price, timestamp, previous_rsi
-                FROM rsi_signals
-            '''
+                return signals
             
-            conditions = []
-            params = []
+        except _DB_ERRORS + (TypeError, ValueError) as e:
+            logger.error("Ошибка при получении сигналов: %s", e)
+            return []
             
-            # Добавляем условия фильтрации
-            if symbol:
-                conditions.append("symbol = " + ("%s" if self.db_type == 'postgresql' else "?"))
-                params.append(symbol)
-                
-            if timeframe:
-                conditions.append("timeframe = " + ("%s" if self.db_type == 'postgresql' else "?"))
-                params.append(timeframe)
+    def iter_recent_signals(self, symbol: str = None, timeframe: str = None, hours_back: float = None,
+                            limit: int = None, before=None, chunk_size: int = 500) -> Iterator[Dict]:
+        """
+        Потоковое чтение сигналов (новые первыми) порциями по chunk_size строк
+        
+        В отличие от get_recent_signals выборка не собирается в память целиком:
+        PostgreSQL читает ее серверным курсором, SQLite - через fetchmany.
+        Пока итератор не исчерпан, соединение занято - другие методы базы
+        внутри цикла вызывать нельзя.
+        """
+        try:
+            with self._connection() as conn:
+                (page_sql, _, sql_query), params = self._signals_query(symbol, timeframe, hours_back, before)
                 
-            if hours_back is not None:
+                if limit is not None:
+                    sql_query = page_sql
+                    params.append(limit)
+                    
                 if self.db_type == 'postgresql':
-                    conditions.append("timestamp >= NOW() - INTERVAL '%s hours'")
+                    cursor = conn.cursor(name='sig_stream', cursor_factory=psycopg2.extras.RealDictCursor)
+                    cursor.itersize = chunk_size
                 else:
-                    conditions.append("timestamp >= datetime('now', '-' || ? || ' hours')")
-                params.append(hours_back)
+                    cursor = conn.cursor()
+                    cursor.arraysize = chunk_size
+                    
+                try:
+                    cursor.execute(sql_query, params)
+                    
+                    while True:
+                        rows = cursor.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                            
+                        for row in rows:
+                            signal = dict(row)
+                            signal['timestamp'] = self._from_db_timestamp(signal['timestamp'])
+                            yield signal
+                finally:
+                    cursor.close()
+                    
+        except _DB_ERRORS + (TypeError, ValueError) as e:
+            logger.error("Ошибка при чтении сигналов: %s", e)
+            
+    def count_signals(self) -> int:
+        """Общее количество сигналов в базе"""
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT COUNT(*) FROM rsi_signals')
+                return cursor.fetchone()[0]
             
-            # Формируем полный SQL запрос
-            if conditions:
-                sql_query = sql_base + " WHERE " + " AND ".join(conditions)
-            else:
-                sql_query = sql_base
-                
-            sql_query += " ORDER BY timestamp DESC"
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при подсчете сигналов: %s", e)
+            return 0
             
-            # Добавляем LIMIT
-            if self.db_type == 'postgresql':
-                sql_query += " LIMIT %s"
-            else:
-                sql_query += " LIMIT ?"
-            params.append(limit)
-            
-            cursor.execute(sql_query, params)
-            rows = cursor.fetchall()
-            
-            signals = []
-            for row in rows:
-                signals.append({
-                    'symbol': row[0],
-                    'timeframe': row[1],
-                    'signal_type': row[2],
-                    'rsi_value': row[3],
-                    'price': row[4],
-                    'timestamp': row[5],
-                    'previous_rsi': row[6]
-                })
-            
-            conn.close()
-            return signals
-            
-        except Exception as e:
-            logger.error(f"Ошибка при получении сигналов: {str(e)}")
-            return []
+    def get_signals_by_symbol(self, symbol: str, limit: int = 50, before=None) -> List[Dict]:
+        """Получение сигналов по символу (before - см. get_recent_signals)"""
+        return self.get_recent_signals(symbol=symbol, limit=limit, before=before)
             
-    def get_signals_by_symbol(self, symbol: str, limit: int = 50) -> List[Dict]:
-        """Получение сигналов по символу"""
+    def has_recent_signal(self, symbol: str, timeframe: str, signal_type: str, timestamp,
+                          window_seconds: float) -> bool:
+        """Есть ли в базе сигнал того же типа ближе window_seconds секунд к timestamp"""
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                
+                window = timedelta(seconds=window_seconds)
+                self._execute_prepared(conn, cursor, 'has_recent_signal', _SQL_HAS_RECENT_SIGNAL, (
+                    symbol, timeframe, signal_type,
+                    self._to_db_timestamp(timestamp - window), self._to_db_timestamp(timestamp + window)
+                ))
+                return cursor.fetchone() is not None
+            
+        except _DB_ERRORS + (TypeError, ValueError) as e:
+            logger.error("Ошибка при проверке недавнего сигнала: %s", e)
+            return False
             
-            if self.db_type == 'postgresql':
-                cursor.execute('''
-                    SELECT symbol, timeframe, signal_type, rsi_value, price, timestamp, previous_rsi
-                    FROM rsi_signals
-                    WHERE symbol = %s
-                    ORDER BY timestamp DESC
-                    LIMIT %s
-                ''', (symbol, limit))
-            else:
-                cursor.execute('''
-                    SELECT symbol, timeframe, signal_type, rsi_value, price, timestamp, previous_rsi
-                    FROM rsi_signals
-                    WHERE symbol = ?
-                    ORDER BY timestamp DESC
-                    LIMIT ?
-                ''', (symbol, limit))
-            
-            rows = cursor.fetchall()
-            
-            signals = []
-            for row in rows:
-                signals.append({
-                    'symbol': row[0],
-                    'timeframe': row[1],
-                    'signal_type': row[2],
-                    'rsi_value': row[3],
-                    'price': row[4],
-                    'timestamp': row[5],
-                    'previous_rsi': row[6]
-                })
-            
-            conn.close()
-            return signals
-            
-        except Exception as e:
-            logger.error(f"Ошибка при получении сигналов по символу: {str(e)}")
-            return []
+    def _write_symbols(self, cursor, symbols: List[str]):
+        """Замена списка символов настроек (в рамках транзакции вызывающего)"""
+        # Символ входит в первичный ключ: повтор записывается один раз (на первой позиции)
+        unique_symbols = list(dict.fromkeys(symbols))
+        if len(unique_symbols) != len(symbols):
+            duplicates = sorted({symbol for symbol in symbols if symbols.count(symbol) > 1})
+            logger.warning("Повторяющиеся символы в настройках сохранены один раз: %s", duplicates)
+        rows = list(enumerate(unique_symbols))
+        
+        if self.db_type == 'postgresql':
+            cursor.execute('DELETE FROM user_symbols WHERE settings_id = 1')
+            cursor.executemany('INSERT INTO user_symbols (settings_id, position, symbol) VALUES (1, %s, %s)', rows)
+        else:
+            cursor.execute('DELETE FROM user_symbols WHERE settings_id = 1')
+            cursor.executemany('INSERT INTO user_symbols (settings_id, position, symbol) VALUES (1, ?, ?)', rows)
             
     def save_user_settings(self, symbols: List[str], timeframe: str, 
                           rsi_oversold: int = 30, rsi_overbought: int = 70) -> bool:
         """Сохранение пользовательских настроек"""
         try:
-            import json
-            
-            conn = self._get_connection()
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
             
-            symbols_json = json.dumps(symbols)
+                # Колонка symbols сохраняет JSON-копию списка для старых версий приложения
+                # (строкой, а не bytes - иначе SQLite сохранит BLOB)
+                symbols_json = orjson.dumps(symbols).decode()
             
-            if self.db_type == 'postgresql':
-                cursor.execute('''
-                    INSERT INTO user_settings 
-                    (id, symbols, timeframe, rsi_oversold, rsi_overbought)
-                    VALUES (1, %s, %s, %s, %s)
-                    ON CONFLICT (id) DO UPDATE SET
-                    symbols = EXCLUDED.symbols,
-                    timeframe = EXCLUDED.timeframe,
-                    rsi_oversold = EXCLUDED.rsi_oversold,
-                    rsi_overbought = EXCLUDED.rsi_overbought
-                ''', (symbols_json, timeframe, rsi_oversold, rsi_overbought))
-            else:
-                cursor.execute('''
-                    INSERT OR REPLACE INTO user_settings 
-                    (id, symbols, timeframe, rsi_oversold, rsi_overbought)
-                    VALUES (1, ?, ?, ?, ?)
-                ''', (symbols_json, timeframe, rsi_oversold, rsi_overbought))
+                if self.db_type == 'postgresql':
+                    cursor.execute('''
+                        INSERT INTO user_settings 
+                        (id, symbols, timeframe, rsi_oversold, rsi_overbought)
+                        VALUES (1, %s, %s, %s, %s)
+                        ON CONFLICT (id) DO UPDATE SET
+                        symbols = EXCLUDED.symbols,
+                        timeframe = EXCLUDED.timeframe,
+                        rsi_oversold = EXCLUDED.rsi_oversold,
+                        rsi_overbought = EXCLUDED.rsi_overbought
+                    ''', (symbols_json, timeframe, rsi_oversold, rsi_overbought))
+                else:
+                    # UPSERT сохраняет notifications_enabled, который INSERT OR REPLACE сбрасывал к умолчанию
+                    cursor.execute('''
+                        INSERT INTO user_settings 
+                        (id, symbols, timeframe, rsi_oversold, rsi_overbought)
+                        VALUES (1, ?, ?, ?, ?)
+                        ON CONFLICT (id) DO UPDATE SET
+                        symbols = excluded.symbols,
+                        timeframe = excluded.timeframe,
+                        rsi_oversold = excluded.rsi_oversold,
+                        rsi_overbought = excluded.rsi_overbought
+                    ''', (symbols_json, timeframe, rsi_oversold, rsi_overbought))
+                    
+                self._write_symbols(cursor, symbols)
             
-            conn.commit()
-            conn.close()
-            logger.info("Настройки пользователя сохранены")
-            return True
+                conn.commit()
+                self._invalidate_settings_cache()
+                logger.info("Настройки пользователя сохранены")
+                return True
             
-        except Exception as e:
-            logger.error(f"Ошибка при сохранении настроек: {str(e)}")
+        except _DB_ERRORS + (TypeError,) as e:
+            logger.error("Ошибка при сохранении настроек: %s", e)
             return False
             
     def get_user_settings(self) -> Optional[Dict]:
         """Получение пользовательских настроек"""
-        try:
-            import json
+        cached = self._settings_cache
+        if cached is not None:
+            return {**cached, 'symbols': list(cached['symbols'])}
             
-            conn = self._get_connection()
-            cursor = conn.cursor()
+        generation = self._cache_generation
+        try:
+            with self._connection() as conn:
+                cursor = self._dict_cursor(conn)
             
-            if self.db_type == 'postgresql':
                 cursor.execute('''
-                    SELECT symbols, timeframe, rsi_oversold, rsi_overbought, notifications_enabled
-                    FROM user_settings WHERE id = 1
-                ''')
-            else:
-                cursor.execute('''
-                    SELECT symbols, timeframe, rsi_oversold, rsi_overbought, notifications_enabled
+                    SELECT timeframe, rsi_oversold, rsi_overbought, notifications_enabled
                     FROM user_settings WHERE id = 1
                 ''')
+                row = cursor.fetchone()
+                
+                if row:
+                    settings = dict(row)
+                    settings['notifications_enabled'] = bool(settings['notifications_enabled'])
+                    
+                    cursor.execute('SELECT symbol FROM user_symbols WHERE settings_id = 1 ORDER BY position')
+                    settings['symbols'] = [symbol_row['symbol'] for symbol_row in cursor]
+                    with self._cache_lock:
+                        if self._cache_generation == generation:
+                            self._settings_cache = settings
+                    return {**settings, 'symbols': list(settings['symbols'])}
+            
+                return None
+            
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при получении настроек: %s", e)
+            return None 
             
-            row = cursor.fetchone()
+    def add_telegram_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
+        """Добавление нового пользователя Telegram"""
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
             
-            conn.close()
+                cursor.execute(_SQL_UPSERT_USER.replace('?', self._ph), (user_id, username, first_name, last_name))
             
-            if row:
-                return {
-                    'symbols': json.loads(row[0]),
-                    'timeframe': row[1],
-                    'rsi_oversold': row[2],
-                    'rsi_overbought': row[3],
-                    'notifications_enabled': bool(row[4])
-                }
+                conn.commit()
+                self._invalidate_user_caches(user_id)
+                logger.info("Пользователь Telegram добавлен: %s (@%s)", user_id, username)
+                return True
             
-            return None
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при добавлении пользователя Telegram: %s", e)
+            return False
             
-        except Exception as e:
-            logger.error(f"Ошибка при получении настроек: {str(e)}")
-            return None 
+    def add_telegram_users_bulk(self, users: List[Dict]) -> int:
+        """
+        Добавление (обновление) многих пользователей Telegram одной транзакцией
+        
+        Args:
+            users: Словари с ключом user_id и необязательными username, first_name, last_name
+        
+        Returns:
+            Количество обработанных пользователей (0 при ошибке)
+        """
+        if not users:
+            return 0
             
-    def add_telegram_user(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None) -> bool:
-        """Добавление нового пользователя Telegram"""
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+            rows = [
+                (user['user_id'], user.get('username'), user.get('first_name'), user.get('last_name'))
+                for user in users
+            ]
+            
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                
+                if self.db_type == 'postgresql':
+                    # Запросы уходят пачками по page_size за один обмен с сервером
+                    psycopg2.extras.execute_batch(cursor, _SQL_UPSERT_USER.replace('?', '%s'), rows, page_size=100)
+                else:
+                    cursor.executemany(_SQL_UPSERT_USER, rows)
+                    
+                conn.commit()
+                self._invalidate_user_caches()
+                logger.info("Пользователей Telegram добавлено: %s", len(rows))
+                return len(rows)
+            
+        except _DB_ERRORS + (KeyError, TypeError) as e:
+            logger.error("Ошибка при добавлении пользователей Telegram: %s", e)
+            return 0
+            
+    def get_telegram_users_brief(self) -> List[Dict]:
+        """Список пользователей Telegram для панели управления (только отображаемые поля)"""
+        try:
+            with self._connection() as conn:
+                cursor = self._dict_cursor(conn)
             
-            if self.db_type == 'postgresql':
-                cursor.execute('''
-                    INSERT INTO telegram_users 
-                    (user_id, username, first_name, last_name, last_activity)
-                    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT (user_id) DO UPDATE SET
-                    username = EXCLUDED.username,
-                    first_name = EXCLUDED.first_name,
-                    last_name = EXCLUDED.last_name,
-                    last_activity = CURRENT_TIMESTAMP
-                ''', (user_id, username, first_name, last_name))
-            else:
                 cursor.execute('''
-                    INSERT OR REPLACE INTO telegram_users 
-                    (user_id, username, first_name, last_name, last_activity)
-                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-                ''', (user_id, username, first_name, last_name))
+                    SELECT user_id, username, first_name, status, created_at
+                    FROM telegram_users
+                    ORDER BY created_at DESC
+                ''')
             
-            conn.commit()
-            conn.close()
-            logger.info(f"Пользователь Telegram добавлен: {user_id} (@{username})")
-            return True
+                return [dict(row) for row in cursor]
             
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении пользователя Telegram: {str(e)}")
-            return False
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при получении пользователей Telegram: %s", e)
+            return []
             
-    def get_telegram_users(self) -> List[Dict]:
-        """Получение всех пользователей Telegram"""
+    def get_telegram_user_detail(self, user_id: int) -> Optional[Dict]:
+        """Все поля одного пользователя Telegram (карточка пользователя в веб-интерфейсе)"""
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, user_id, username, first_name, last_name, status, 
-                       created_at, approved_at, last_activity
-                FROM telegram_users
-                ORDER BY created_at DESC
-            ''')
-            
-            rows = cursor.fetchall()
-            
-            users = []
-            for row in rows:
-                users.append({
-                    'id': row[0],
-                    'user_id': row[1],
-                    'username': row[2],
-                    'first_name': row[3],
-                    'last_name': row[4],
-                    'status': row[5],
-                    'created_at': row[6],
-                    'approved_at': row[7],
-                    'last_activity': row[8]
-                })
-            
-            conn.close()
-            return users
-            
-        except Exception as e:
-            logger.error(f"Ошибка при получении пользователей Telegram: {str(e)}")
-            return []
+            with self._connection() as conn:
+                cursor = self._dict_cursor(conn)
+                cursor.execute('''
+                    SELECT id, user_id, username, first_name, last_name, status, 
+                           created_at, approved_at, last_activity
+                    FROM telegram_users WHERE user_id = ''' + self._ph, (user_id,))
+                    
+                row = cursor.fetchone()
+                return dict(row) if row else None
+            
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при получении пользователя Telegram: %s", e)
+            return None
             
     def get_approved_telegram_users(self) -> List[Dict]:
         """Получение одобренных пользователей Telegram"""
+        # Рассылка запрашивает список на каждый сигнал - отдаем копию из кэша
+        cached = self._approved_users_cache
+        if cached is not None:
+            return [dict(user) for user in cached]
+            
+        generation = self._cache_generation
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT user_id, username, first_name, last_name
-                FROM telegram_users
-                WHERE status = 'approved'
-            ''')
-            
-            rows = cursor.fetchall()
-            
-            users = []
-            for row in rows:
-                users.append({
-                    'user_id': row[0],
-                    'username': row[1],
-                    'first_name': row[2],
-                    'last_name': row[3]
-                })
-            
-            conn.close()
-            return users
-            
-        except Exception as e:
-            logger.error(f"Ошибка при получении одобренных пользователей: {str(e)}")
+            with self._connection() as conn:
+                cursor = self._dict_cursor(conn)
+            
+                cursor.execute('''
+                    SELECT user_id, username, first_name, last_name
+                    FROM telegram_users
+                    WHERE status = 'approved'
+                ''')
+                
+                users = [dict(row) for row in cursor]
+                with self._cache_lock:
+                    if self._cache_generation == generation:
+                        self._approved_users_cache = users
+                return [dict(user) for user in users]
+            
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при получении одобренных пользователей: %s", e)
             return []
             
     def update_telegram_user_status(self, user_id: int, status: str) -> bool:
         """Обновление статуса пользователя Telegram"""
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
             
-            if self.db_type == 'postgresql':
-                if status == 'approved':
-                    cursor.execute('''
-                        UPDATE telegram_users 
-                        SET status = %s, approved_at = CURRENT_TIMESTAMP
-                        WHERE user_id = %s
-                    ''', (status, user_id))
-                else:
-                    cursor.execute('''
-                        UPDATE telegram_users 
-                        SET status = %s, approved_at = NULL
-                        WHERE user_id = %s
-                    ''', (status, user_id))
-            else:
-                if status == 'approved':
-                    cursor.execute('''
-                        UPDATE telegram_users 
-                        SET status = ?, approved_at = CURRENT_TIMESTAMP
-                        WHERE user_id = ?
-                    ''', (status, user_id))
+                # Время одобрения ставится только при статусе approved, иначе сбрасывается
+                self._execute_prepared(conn, cursor, 'update_user_status', _SQL_UPDATE_USER_STATUS, (status, status, user_id))
+            
+                # Если пользователь не найден, фиксировать нечего - пустая транзакция откатывается
+                if cursor.rowcount > 0:
+                    conn.commit()
+                    self._invalidate_user_caches(user_id)
+                    logger.info("Статус пользователя %s обновлен на '%s'", user_id, status)
+                    return True
                 else:
-                    cursor.execute('''
-                        UPDATE telegram_users 
-                        SET status = ?, approved_at = NULL
-                        WHERE user_id = ?
-                    ''', (status, user_id))
+                    logger.warning("Пользователь %s не найден", user_id)
+                    return False
+            
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при обновлении статуса пользователя: %s", e)
+            return False
             
-            if cursor.rowcount > 0:
+    def update_telegram_users_status(self, user_ids: List[int], status: str) -> int:
+        """Обновление статуса многих пользователей Telegram одним запросом (возвращает число обновленных)"""
+        if not user_ids:
+            return 0
+            
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                
+                sql_query = _SQL_UPDATE_USER_STATUS.replace('user_id = ?', 'user_id IN (' + ', '.join(['?'] * len(user_ids)) + ')')
+                cursor.execute(sql_query.replace('?', self._ph), [status, status] + list(user_ids))
+                updated = cursor.rowcount
+                
                 conn.commit()
-                conn.close()
-                logger.info(f"Статус пользователя {user_id} обновлен на '{status}'")
-                return True
-            else:
-                conn.close()
-                logger.warning(f"Пользователь {user_id} не найден")
-                return False
+                self._invalidate_user_caches()
+                logger.info("Статус '%s' установлен пользователям: %s", status, updated)
+                return updated
             
-        except Exception as e:
-            logger.error(f"Ошибка при обновлении статуса пользователя: {str(e)}")
-            return False
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при обновлении статуса пользователей: %s", e)
+            return 0
             
     def delete_telegram_user(self, user_id: int) -> bool:
         """Удаление пользователя Telegram"""
         try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
             
-            if self.db_type == 'postgresql':
-                cursor.execute('DELETE FROM telegram_users WHERE user_id = %s', (user_id,))
-            else:
-                cursor.execute('DELETE FROM telegram_users WHERE user_id = ?', (user_id,))
+                self._execute_prepared(conn, cursor, 'delete_user', _SQL_DELETE_USER, (user_id,))
             
-            if cursor.rowcount > 0:
-                conn.commit()
-                conn.close()
-                logger.info(f"Пользователь {user_id} удален")
-                return True
-            else:
-                conn.close()
-                logger.warning(f"Пользователь {user_id} не найден для удаления")
-                return False
+                if cursor.rowcount > 0:
+                    conn.commit()
+                    self._invalidate_user_caches(user_id)
+                    logger.info("Пользователь %s удален", user_id)
+                    return True
+                else:
+                    logger.warning("Пользователь %s не найден для удаления", user_id)
+                    return False
             
-        except Exception as e:
-            logger.error(f"Ошибка при удалении пользователя: {str(e)}")
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при удалении пользователя: %s", e)
             return False
             
     def get_telegram_user_status(self, user_id: int) -> Optional[str]:
         """Получение статуса пользователя Telegram"""
-        try:
-            conn = self._get_connection()
-            cursor = conn.cursor()
-            
-            if self.db_type == 'postgresql':
-                cursor.execute('SELECT status FROM telegram_users WHERE user_id = %s', (user_id,))
-            else:
-                cursor.execute('SELECT status FROM telegram_users WHERE user_id = ?', (user_id,))
-            row = cursor.fetchone()
-            
-            conn.close()
+        if user_id in self._status_cache:
+            return self._status_cache[user_id]
             
-            return row[0] if row else None
+        generation = self._cache_generation
+        try:
+            with self._connection() as conn:
+                cursor = conn.cursor()
             
-        except Exception as e:
-            logger.error(f"Ошибка при получении статуса пользователя: {str(e)}")
+                self._execute_prepared(conn, cursor, 'user_status', _SQL_USER_STATUS, (user_id,))
+                row = cursor.fetchone()
+                
+                status = row[0] if row else None
+                with self._cache_lock:
+                    if self._cache_generation == generation:
+                        self._status_cache[user_id] = status
+                return status
+            
+        except _DB_ERRORS as e:
+            logger.error("Ошибка при получении статуса пользователя: %s", e)
             return None
\ No newline at end of file
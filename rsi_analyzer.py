@@ -1,20 +1,80 @@
+import bisect
+import calendar
 import logging
+import math
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Dict, List, Optional, Tuple
 from database import RSIDatabase
+from rsi_utils import CROSSING_TYPES, LIVE_CROSSING_CODES, crossing_state, scan_rsi_crossings
 
 logger = logging.getLogger(__name__)
 
+# Сигналы одного типа ближе этого интервала (секунды) считаются дублями
+DUPLICATE_WINDOW = 120
+
+# Стрелка уведомления в зависимости от зоны RSI
+_ARROW_MAP = {
+    'oversold_enter': '↓',    # Вход в зону перепроданности
+    'oversold_exit': '↓',     # Выход из зоны перепроданности (все о перепроданности = ↓)
+    'overbought_enter': '↑',  # Вход в зону перекупленности  
+    'overbought_exit': '↑'    # Выход из зоны перекупленности (все о перекупленности = ↑)
+}
+
+# Таймфреймы в формате TradingView
+_TV_TF_MAP = {
+    '1m': '1', '3m': '3', '5m': '5', '15m': '15', '30m': '30',
+    '1h': '60', '2h': '120', '4h': '240', '6h': '360', 
+    '8h': '480', '12h': '720', '1d': 'D'
+}
+
+# Уведомляем о всех пересечениях границ RSI
+_NOTIFY_SIGNALS = frozenset(_ARROW_MAP)
+
+_TV_URL = "https://www.tradingview.com/chart/?symbol=BINANCE:{symbol}&interval={interval}"
+
+
+@lru_cache(maxsize=1024)
+def _tradingview_url(symbol: str, timeframe: str) -> str:
+    """URL графика TradingView (зависит только от символа и таймфрейма - строится один раз)"""
+    # Заменяем котировку USDT на USD для TradingView
+    if symbol.endswith('USDT'):
+        symbol = symbol[:-4] + 'USD'
+        
+    # Конвертируем таймфрейм в формат TradingView
+    return _TV_URL.format(symbol=symbol, interval=_TV_TF_MAP.get(timeframe, '5'))
+
+
+def _epoch_seconds(timestamp) -> float:
+    """
+    Время сигнала в секундах с эпохи (наивное время считается UTC)
+    
+    Время свечи - pd.Timestamp, время из базы - всегда datetime (см. RSIDatabase._from_db_timestamp).
+    """
+    # pd.Timestamp хранит наносекунды с эпохи
+    if hasattr(timestamp, 'value'):
+        return timestamp.value / 10**9
+    return calendar.timegm(timestamp.utctimetuple()) + timestamp.microsecond / 10**6
+
 class RSIAnalyzer:
     def __init__(self, config, database: RSIDatabase):
         """Инициализация RSI анализатора"""
         self.config = config
         self.database = database
         self.previous_rsi_states = {}  # Хранение предыдущих состояний RSI
+        # (symbol, timeframe, signal_type) -> отсортированные времена сигналов, найденных
+        # этим анализатором: они могут быть еще не сохранены в базу
+        self._recent_signal_cache = {}
+        
+    def analyze_rsi_signals(self, symbol: str, timeframe: str, df: pd.DataFrame, save: bool = True) -> List[Dict]:
+        """
+        Анализ RSI сигналов для символа с проверкой только последней свечи
         
-    def analyze_rsi_signals(self, symbol: str, timeframe: str, df: pd.DataFrame) -> List[Dict]:
-        """Анализ RSI сигналов для символа с проверкой только последней свечи"""
+        При save=False сигналы не записываются в базу - их сохраняет вызывающий код
+        (например, пачкой за весь цикл анализа через add_signals)
+        """
         try:
             if df is None or len(df) < 2:
                 return []
@@ -22,39 +82,25 @@ class RSIAnalyzer:
             signals = []
             
             # Проверяем только последние две свечи для определения пересечения
-            current_rsi = df['rsi'].iloc[-1]
-            previous_rsi = df['rsi'].iloc[-2]
-            current_price = df['close'].iloc[-1]
+            # (значения берутся из массивов NumPy - без индексатора pandas)
+            rsi = df['rsi'].to_numpy()
+            current_rsi = rsi[-1]
+            previous_rsi = rsi[-2]
+            current_price = df['close'].to_numpy()[-1]
             current_time = df.index[-1]
             
             # Пропускаем NaN значения
-            if pd.isna(current_rsi) or pd.isna(previous_rsi):
+            if math.isnan(current_rsi) or math.isnan(previous_rsi):
                 return []
             
 
             
-            signal_type = None
-            
-            # Все возможные пересечения RSI границ
-            # Пересечение уровня перепроданности (30) сверху вниз (вход в зону)
-            if (previous_rsi > self.config.RSI_OVERSOLD and 
-                current_rsi <= self.config.RSI_OVERSOLD):
-                signal_type = "oversold_enter"
-                
-            # Пересечение уровня перепроданности (30) снизу вверх (выход из зоны)
-            elif (previous_rsi <= self.config.RSI_OVERSOLD and 
-                  current_rsi > self.config.RSI_OVERSOLD):
-                signal_type = "oversold_exit"
-                
-            # Пересечение уровня перекупленности (70) снизу вверх (вход в зону)
-            elif (previous_rsi < self.config.RSI_OVERBOUGHT and 
-                  current_rsi >= self.config.RSI_OVERBOUGHT):
-                signal_type = "overbought_enter"
-                
-            # Пересечение уровня перекупленности (70) сверху вниз (выход из зоны)
-            elif (previous_rsi >= self.config.RSI_OVERBOUGHT and 
-                  current_rsi < self.config.RSI_OVERBOUGHT):
-                signal_type = "overbought_exit"
+            # Все возможные пересечения RSI границ: вход в зону перепроданности (сверху вниз),
+            # выход из нее, вход в зону перекупленности (снизу вверх), выход из нее - тип по таблице
+            code = LIVE_CROSSING_CODES[crossing_state(
+                previous_rsi, current_rsi, self.config.RSI_OVERSOLD, self.config.RSI_OVERBOUGHT
+            )]
+            signal_type = CROSSING_TYPES[code] if code >= 0 else None
             
             # Если обнаружено пересечение, создаем сигнал
             if signal_type:
@@ -68,23 +114,12 @@ class RSIAnalyzer:
                     'previous_rsi': previous_rsi
                 }
                 
-                # Проверяем, не дублируется ли сигнал
-                if not self._is_duplicate_signal(signal):
+                if self._accept_signal(signal):
                     signals.append(signal)
                     
                     # Сохраняем сигнал в базу данных
-                    self.database.add_signal(
-                        symbol=symbol,
-                        timeframe=timeframe,
-                        signal_type=signal_type,
-                        rsi_value=current_rsi,
-                        price=current_price,
-                        timestamp=current_time,
-                        previous_rsi=previous_rsi
-                    )
-                    
-                    logger.info(f"RSI сигнал: {symbol} {timeframe} {signal_type} "
-                               f"RSI: {previous_rsi:.2f} -> {current_rsi:.2f}")
+                    if save:
+                        self.database.add_signals([signal])
             
             return signals
             
@@ -93,36 +128,114 @@ class RSIAnalyzer:
             return []
             
 
-    def _is_duplicate_signal(self, signal: Dict) -> bool:
-        """Проверка на дублирование сигнала"""
+    def analyze_rsi_signals_batch(self, symbol_dfs: Dict[str, pd.DataFrame], timeframe: str) -> List[Dict]:
+        """
+        Анализ последней свечи сразу для всех символов (сигналы не сохраняются в базу)
+        
+        Последние два значения RSI всех символов собираются в массивы, и пересечения
+        определяются одним векторным сравнением с тем же приоритетом, что в analyze_rsi_signals.
+        Пакет собран на NumPy, а не на Polars LazyFrame: Polars не входит в зависимости
+        проекта, а на каждый символ за цикл приходится всего два значения RSI.
+        """
         try:
-            symbol = signal['symbol']
-            timeframe = signal['timeframe'] 
-            signal_type = signal['signal_type']
-            current_time = signal['timestamp']
-            
-            # Проверяем последние сигналы за 3 минуты
-            recent_signals = self.database.get_recent_signals(symbol, timeframe, hours_back=0.05)  # 3 минуты
-            
-            for recent_signal in recent_signals:
-                if recent_signal.get('signal_type') == signal_type:
-                    # Проверяем временную близость
-                    signal_time = recent_signal.get('timestamp', '')
-                    if isinstance(signal_time, str):
-                        signal_time = pd.to_datetime(signal_time)
-                    current_time_pd = pd.to_datetime(current_time)
+            symbols = []
+            rsi_pairs = []
+            frames = []
+            
+            for symbol, df in symbol_dfs.items():
+                if df is None or len(df) < 2:
+                    logger.warning(f"Недостаточно данных для {symbol}")
+                    continue
                     
-                    # Если разница менее 2 минут - считаем дублем
-                    if abs((signal_time - current_time_pd).total_seconds()) < 120:
-                        logger.debug(f"Найден дублирующий сигнал для {symbol} {signal_type}")
-                        return True
+                rsi = df['rsi'].to_numpy(dtype=float)
+                symbols.append(symbol)
+                rsi_pairs.append((rsi[-2], rsi[-1]))
+                frames.append(df)
+                
+            if not symbols:
+                return []
+                
+            previous, current = np.array(rsi_pairs).T
+            
+            # Символы без RSI (NaN) получают нулевое состояние - сигнала нет
+            codes = np.take(LIVE_CROSSING_CODES, crossing_state(
+                previous, current, self.config.RSI_OVERSOLD, self.config.RSI_OVERBOUGHT
+            ))
+            
+            signals = []
+            for i in np.flatnonzero(codes >= 0).tolist():
+                df = frames[i]
+                signal = {
+                    'symbol': symbols[i],
+                    'timeframe': timeframe,
+                    'signal_type': CROSSING_TYPES[codes[i]],
+                    'rsi_value': float(current[i]),
+                    'price': df['close'].iat[-1],
+                    'timestamp': df.index[-1],
+                    'previous_rsi': float(previous[i])
+                }
+                
+                if self._accept_signal(signal):
+                    signals.append(signal)
                     
-            return False
+            return signals
             
         except Exception as e:
-            logger.error(f"Ошибка при проверке дублирования сигнала: {str(e)}")
+            logger.error(f"Ошибка при пакетном анализе RSI: {str(e)}")
+            return []
+            
+    def _accept_signal(self, signal: Dict) -> bool:
+        """
+        Отбор нового сигнала: дубли отбрасываются, принятый сигнал запоминается
+        
+        Ошибки не перехватываются - их обрабатывают публичные методы анализа.
+        """
+        # Проверяем, не дублируется ли сигнал
+        if self._is_duplicate_signal(signal):
             return False
             
+        self._remember_signal(signal)
+        logger.info(f"RSI сигнал: {signal['symbol']} {signal['timeframe']} {signal['signal_type']} "
+                   f"RSI: {signal['previous_rsi']:.2f} -> {signal['rsi_value']:.2f}")
+        return True
+        
+    def _is_duplicate_signal(self, signal: Dict) -> bool:
+        """Проверка на дублирование сигнала (ошибки базы обрабатывает has_recent_signal)"""
+        symbol = signal['symbol']
+        signal_type = signal['signal_type']
+        
+        # Сначала свои недавние сигналы: ближайший позже current_time - DUPLICATE_WINDOW
+        # должен быть раньше current_time + DUPLICATE_WINDOW
+        times = self._recent_signal_cache.get((symbol, signal['timeframe'], signal_type))
+        if times:
+            current_time = _epoch_seconds(signal['timestamp'])
+            i = bisect.bisect_right(times, current_time - DUPLICATE_WINDOW)
+            if i < len(times) and times[i] < current_time + DUPLICATE_WINDOW:
+                logger.debug(f"Найден дублирующий сигнал для {symbol} {signal_type}")
+                return True
+                
+        # Затем база: проверка по индексу, без выборки и перебора последних сигналов
+        if self.database.has_recent_signal(symbol, signal['timeframe'], signal_type,
+                                           signal['timestamp'], DUPLICATE_WINDOW):
+            logger.debug(f"Найден дублирующий сигнал для {symbol} {signal_type}")
+            return True
+            
+        return False
+        
+    def _remember_signal(self, signal: Dict):
+        """
+        Добавление нового сигнала в кэш последних сигналов
+        
+        Сигнал может попасть в базу позже (пачкой в конце цикла), но повтор
+        должен распознаваться сразу. Сигналы старше окна дублей удаляются.
+        """
+        times = self._recent_signal_cache.setdefault(
+            (signal['symbol'], signal['timeframe'], signal['signal_type']), []
+        )
+        current_time = _epoch_seconds(signal['timestamp'])
+        del times[:bisect.bisect_right(times, current_time - DUPLICATE_WINDOW)]
+        bisect.insort(times, current_time)
+        
     def analyze_historical_rsi_signals(self, symbol: str, timeframe: str, df: pd.DataFrame, days_back: int = 2) -> List[Dict]:
         """Анализ исторических RSI сигналов за указанный период"""
         try:
@@ -135,8 +248,12 @@ class RSIAnalyzer:
             end_time = datetime.now()
             start_time = end_time - timedelta(days=days_back)
             
-            # Фильтруем DataFrame по времени
-            historical_df = df[df.index >= start_time]
+            # Фильтруем DataFrame по времени: у отсортированного индекса - бинарным поиском,
+            # срез iloc не строит булеву маску и не копирует строки
+            if df.index.is_monotonic_increasing:
+                historical_df = df.iloc[df.index.searchsorted(pd.Timestamp(start_time)):]
+            else:
+                historical_df = df[df.index >= start_time]
             
             if len(historical_df) < 2:
                 logger.warning(f"Недостаточно исторических данных для {symbol}")
@@ -144,59 +261,31 @@ class RSIAnalyzer:
             
             logger.info(f"Анализируем исторические данные для {symbol} за {days_back} дней: {len(historical_df)} свечей")
             
-            # Проходим по всем свечам и ищем пересечения RSI
-            for i in range(1, len(historical_df)):
-                current_row = historical_df.iloc[i]
-                previous_row = historical_df.iloc[i-1]
-                
-                current_rsi = current_row['rsi']
-                previous_rsi = previous_row['rsi']
-                current_price = current_row['close']
-                current_time = current_row.name
-                
-                # Пропускаем NaN значения
-                if pd.isna(current_rsi) or pd.isna(previous_rsi):
-                    continue
-                
-                signal_type = None
-                
-                # Пересечение уровня перепроданности (30) снизу вверх
-                if (previous_rsi <= self.config.RSI_OVERSOLD and 
-                    current_rsi > self.config.RSI_OVERSOLD):
-                    signal_type = "oversold_exit"
-                    
-                # Пересечение уровня перекупленности (70) сверху вниз
-                elif (previous_rsi >= self.config.RSI_OVERBOUGHT and 
-                      current_rsi < self.config.RSI_OVERBOUGHT):
-                    signal_type = "overbought_exit"
-                    
-                # Пересечение уровня перепроданности (30) сверху вниз
-                elif (previous_rsi > self.config.RSI_OVERSOLD and 
-                      current_rsi <= self.config.RSI_OVERSOLD):
-                    signal_type = "oversold_enter"
-                    
-                # Пересечение уровня перекупленности (70) снизу вверх
-                elif (previous_rsi < self.config.RSI_OVERBOUGHT and 
-                      current_rsi >= self.config.RSI_OVERBOUGHT):
-                    signal_type = "overbought_enter"
+            # Пересечения ищем одним проходом скомпилированного ядра по всему ряду RSI
+            rsi = historical_df['rsi'].to_numpy(dtype=float)
+            codes = scan_rsi_crossings(rsi, float(self.config.RSI_OVERSOLD), float(self.config.RSI_OVERBOUGHT))
+            idx = np.flatnonzero(codes >= 0)
+            
+            # Значения берутся только для свечей с сигналом
+            closes = historical_df['close'].to_numpy()[idx]
+            times = historical_df.index[idx]
+            signal_types = [CROSSING_TYPES[code] for code in codes[idx].tolist()]
+            
+            for signal_type, current_rsi, previous_rsi, current_price, current_time in zip(
+                    signal_types, rsi[idx].tolist(), rsi[idx - 1].tolist(), closes.tolist(), times):
+                signals.append({
+                    'symbol': symbol,
+                    'timeframe': timeframe,
+                    'signal_type': signal_type,
+                    'rsi_value': current_rsi,
+                    'price': current_price,
+                    'timestamp': current_time,
+                    'previous_rsi': previous_rsi,
+                    'historical': True  # Помечаем как исторический
+                })
                 
-                # Если обнаружено пересечение, создаем сигнал
-                if signal_type:
-                    signal = {
-                        'symbol': symbol,
-                        'timeframe': timeframe,
-                        'signal_type': signal_type,
-                        'rsi_value': current_rsi,
-                        'price': current_price,
-                        'timestamp': current_time,
-                        'previous_rsi': previous_rsi,
-                        'historical': True  # Помечаем как исторический
-                    }
-                    
-                    signals.append(signal)
-                    
-                    logger.debug(f"Исторический RSI сигнал: {symbol} {timeframe} {signal_type} "
-                               f"RSI: {previous_rsi:.2f} -> {current_rsi:.2f} в {current_time}")
+                logger.debug(f"Исторический RSI сигнал: {symbol} {timeframe} {signal_type} "
+                           f"RSI: {previous_rsi:.2f} -> {current_rsi:.2f} в {current_time}")
             
             logger.info(f"Найдено {len(signals)} исторических сигналов для {symbol} за {days_back} дней")
             return signals
@@ -209,21 +298,13 @@ class RSIAnalyzer:
         """Получение описания сигнала для уведомления"""
         try:
             # Определяем стрелку в зависимости от зоны RSI
-            arrow_map = {
-                'oversold_enter': '↓',    # Вход в зону перепроданности
-                'oversold_exit': '↓',     # Выход из зоны перепроданности (все о перепроданности = ↓)
-                'overbought_enter': '↑',  # Вход в зону перекупленности  
-                'overbought_exit': '↑'    # Выход из зоны перекупленности (все о перекупленности = ↑)
-            }
-            
-            signal_type = signal['signal_type']
-            arrow = arrow_map.get(signal_type, '')
+            arrow = _ARROW_MAP.get(signal['signal_type'], '')
             
             if not arrow:
                 return ""
             
             # Простой формат: название монеты + стрелка
-            symbol_clean = signal['symbol'].replace('USDT', '')
+            symbol_clean = signal['symbol'].removesuffix('USDT')
             
             return f"{symbol_clean} {arrow}"
             
@@ -234,22 +315,7 @@ class RSIAnalyzer:
     def get_tradingview_url(self, symbol: str, timeframe: str) -> str:
         """Генерация URL для TradingView"""
         try:
-            # Убираем USDT из символа для TradingView
-            tv_symbol = symbol.replace('USDT', 'USD')
-            
-            # Конвертируем таймфрейм в формат TradingView
-            tv_timeframe_map = {
-                '1m': '1', '3m': '3', '5m': '5', '15m': '15', '30m': '30',
-                '1h': '60', '2h': '120', '4h': '240', '6h': '360', 
-                '8h': '480', '12h': '720', '1d': 'D'
-            }
-            
-            tv_timeframe = tv_timeframe_map.get(timeframe, '5')
-            
-            url = (f"https://www.tradingview.com/chart/?symbol=BINANCE:{tv_symbol}"
-                   f"&interval={tv_timeframe}")
-            
-            return url
+            return _tradingview_url(symbol, timeframe)
             
         except Exception as e:
             logger.error(f"Ошибка при генерации TradingView URL: {str(e)}")
@@ -264,10 +330,7 @@ class RSIAnalyzer:
             if not user_settings or not user_settings.get('notifications_enabled', True):
                 return False
                 
-            # Уведомляем о всех пересечениях границ RSI
-            notify_signals = ['oversold_enter', 'oversold_exit', 'overbought_enter', 'overbought_exit']
-            
-            is_notify = signal['signal_type'] in notify_signals
+            is_notify = signal['signal_type'] in _NOTIFY_SIGNALS
             
             if is_notify:
                 logger.info(f"Отправляем уведомление для сигнала: {signal['symbol']} {signal['signal_type']}")
@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import time
 from datetime import datetime
 from typing import List, Dict
 from aiogram import Bot
@@ -16,6 +17,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Интервал обслуживания базы данных (секунды)
+DB_MAINTENANCE_INTERVAL = 15 * 60
+
+# Интервал удаления старых сигналов (секунды)
+SIGNAL_PURGE_INTERVAL = 24 * 60 * 60
+
 class RSIBot:
     def __init__(self):
         """Инициализация RSI бота"""
@@ -108,46 +115,35 @@ class RSIBot:
         except Exception as e:
             logger.error(f"Ошибка при отправке уведомления: {str(e)}")
             
-    async def analyze_symbol(self, symbol: str):
-        """Анализ одного символа"""
+    async def run_analysis_cycle(self):
+        """Один цикл анализа всех символов"""
         try:
-            # Получаем исторические данные
-            df = await self.hybrid_connector.get_historical_data(
-                symbol=symbol,
+            logger.info(f"Начинаем анализ {len(self.current_symbols)} символов")
+            
+            # Загружаем данные по всем символам параллельно
+            # (rate limiting выполняется внутри коннекторов)
+            symbols_data = await self.hybrid_connector.get_historical_data_batch(
+                symbols=self.current_symbols,
                 timeframe=self.current_timeframe,
                 limit=50
             )
             
-            if df is None or len(df) < 2:
-                logger.warning(f"Недостаточно данных для {symbol}")
-                return
-                
-            # Анализируем RSI сигналы
-            signals = self.rsi_analyzer.analyze_rsi_signals(
-                symbol=symbol,
-                timeframe=self.current_timeframe,
-                df=df
+            # Анализируем все символы одним векторным проходом
+            # (проверка дублей обращается к базе - выполняем в отдельном потоке, как и запись)
+            signals = await asyncio.to_thread(
+                self.rsi_analyzer.analyze_rsi_signals_batch,
+                {symbol: symbols_data.get(symbol) for symbol in self.current_symbols},
+                self.current_timeframe
             )
-            
+                
+            # Сохраняем все сигналы цикла одной транзакцией
+            if signals:
+                await asyncio.to_thread(self.database.add_signals, signals)
+                
             # Отправляем уведомления для найденных сигналов
             for signal in signals:
                 if self.rsi_analyzer.should_notify(signal):
                     await self.send_telegram_notification(signal)
-                    
-        except Exception as e:
-            logger.error(f"Ошибка при анализе {symbol}: {str(e)}")
-            
-
-            
-    async def run_analysis_cycle(self):
-        """Один цикл анализа всех символов"""
-        try:
-            logger.info(f"Начинаем анализ {len(self.current_symbols)} символов")
-            
-            # Анализируем каждый символ
-            for symbol in self.current_symbols:
-                await self.analyze_symbol(symbol)
-                await asyncio.sleep(1.5)  # Пауза для rate limiting
                 
             logger.info("Цикл анализа завершен")
             
@@ -168,9 +164,20 @@ class RSIBot:
             logger.info(f"Веб-сервер запущен на http://{self.config.WEB_HOST}:{self.config.WEB_PORT}")
             
             # Основной цикл работы
+            last_maintenance = time.monotonic()
+            last_purge = None
             while self.is_running:
                 try:
                     await self.run_analysis_cycle()
+                    
+                    if time.monotonic() - last_maintenance >= DB_MAINTENANCE_INTERVAL:
+                        await asyncio.to_thread(self.database.optimize)
+                        last_maintenance = time.monotonic()
+                        
+                    if last_purge is None or time.monotonic() - last_purge >= SIGNAL_PURGE_INTERVAL:
+                        await asyncio.to_thread(self.database.purge_old_signals, self.config.SIGNAL_RETENTION_DAYS)
+                        last_purge = time.monotonic()
+                        
                     await asyncio.sleep(self.config.CHECK_INTERVAL)
                     
                 except Exception as e:
@@ -203,7 +210,9 @@ class RSIBot:
                 await self.telegram_bot.session.close()
                 
             if self.hybrid_connector:
-                self.hybrid_connector.close()
+                await self.hybrid_connector.close()
+                
+            self.database.close()
                 
             logger.info("✅ RSI бот остановлен")
             
@@ -1,9 +1,229 @@
 """
-Утилиты для расчета RSI без pandas-ta (запасной вариант)
+Утилиты для расчета RSI без pandas-ta
 """
 import pandas as pd
 import numpy as np
 
+try:
+    from numba import njit
+except ImportError:  # без Numba ядра работают как обычные Python-функции
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+
+@njit(cache=True)
+def wilder_rsi(close: np.ndarray, period: int = 14) -> np.ndarray:
+    """
+    Расчет RSI по Уайлдеру за один проход (скомпилирован Numba)
+    
+    Первые period изменений усредняются простым средним, далее
+    применяется сглаживание Уайлдера: avg = (avg * (period - 1) + x) / period
+    
+    Args:
+        close: Массив цен закрытия (float64)
+        period: Период для расчета RSI (по умолчанию 14)
+    
+    Returns:
+        Массив значений RSI (первые period значений - NaN)
+    """
+    n = close.shape[0]
+    rsi = np.full(n, np.nan)
+    
+    if n <= period:
+        return rsi
+    
+    # Начальные средние - простое среднее первых period изменений
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for i in range(1, period + 1):
+        delta = close[i] - close[i - 1]
+        if delta > 0:
+            avg_gain += delta
+        else:
+            avg_loss -= delta
+    avg_gain /= period
+    avg_loss /= period
+    
+    for i in range(period, n):
+        if i > period:
+            delta = close[i] - close[i - 1]
+            gain = delta if delta > 0 else 0.0
+            loss = -delta if delta < 0 else 0.0
+            avg_gain = (avg_gain * (period - 1) + gain) / period
+            avg_loss = (avg_loss * (period - 1) + loss) / period
+            
+        if avg_loss == 0.0:
+            rsi[i] = 100.0
+        else:
+            rsi[i] = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    
+    return rsi
+
+
+def wilder_step(avg_gain: float, avg_loss: float, delta: float, period: int = 14):
+    """
+    Один шаг сглаживания Уайлдера для новой свечи
+
+    Args:
+        avg_gain: Текущий средний рост
+        avg_loss: Текущее среднее падение
+        delta: Изменение цены закрытия относительно предыдущей свечи
+        period: Период для расчета RSI (по умолчанию 14)
+
+    Returns:
+        Кортеж (avg_gain, avg_loss, rsi) после добавления свечи
+    """
+    gain = delta if delta > 0 else 0.0
+    loss = -delta if delta < 0 else 0.0
+    avg_gain = (avg_gain * (period - 1) + gain) / period
+    avg_loss = (avg_loss * (period - 1) + loss) / period
+
+    if avg_loss == 0.0:
+        return avg_gain, avg_loss, 100.0
+    return avg_gain, avg_loss, 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+
+@njit(cache=True)
+def wilder_state(close: np.ndarray, period: int = 14):
+    """
+    Состояние сглаживания Уайлдера (avg_gain, avg_loss) после всего ряда цен
+
+    Считается так же, как в wilder_rsi, поэтому продолжение ряда через
+    wilder_step дает те же значения, что и полный пересчет.
+    Для ряда короче period + 1 цен возвращает (NaN, NaN).
+    """
+    n = close.shape[0]
+    if n <= period:
+        return np.nan, np.nan
+
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for i in range(1, period + 1):
+        delta = close[i] - close[i - 1]
+        if delta > 0:
+            avg_gain += delta
+        else:
+            avg_loss -= delta
+    avg_gain /= period
+    avg_loss /= period
+
+    for i in range(period + 1, n):
+        delta = close[i] - close[i - 1]
+        gain = delta if delta > 0 else 0.0
+        loss = -delta if delta < 0 else 0.0
+        avg_gain = (avg_gain * (period - 1) + gain) / period
+        avg_loss = (avg_loss * (period - 1) + loss) / period
+
+    return avg_gain, avg_loss
+
+
+def wilder_extend(avg_gain: float, avg_loss: float, prev_close: float, closes: np.ndarray, period: int = 14):
+    """
+    Продолжение RSI Уайлдера на новые свечи
+
+    Args:
+        avg_gain: Средний рост на последней закрытой свече
+        avg_loss: Среднее падение на последней закрытой свече
+        prev_close: Цена закрытия последней закрытой свечи
+        closes: Цены закрытия новых свечей (последняя еще формируется)
+        period: Период для расчета RSI (по умолчанию 14)
+
+    Returns:
+        Кортеж (rsi, avg_gain, avg_loss): массив RSI для новых свечей и
+        состояние на предпоследней из них - последней закрытой
+    """
+    rsi = np.empty(len(closes))
+
+    for i, close in enumerate(closes):
+        gain, loss, rsi[i] = wilder_step(avg_gain, avg_loss, close - prev_close, period)
+        if i < len(closes) - 1:
+            avg_gain, avg_loss = gain, loss
+        prev_close = close
+
+    return rsi, avg_gain, avg_loss
+
+
+# Типы сигналов пересечения уровней RSI (коды сигналов - индексы в этом кортеже)
+CROSSING_TYPES = ("oversold_exit", "overbought_exit", "oversold_enter", "overbought_enter")
+
+
+def _crossing_table(priority) -> np.ndarray:
+    """
+    Таблица кодов сигналов по состоянию перехода (см. crossing_state)
+    
+    Состояние - два бита по уровню перепроданности (RSI > уровня на предыдущей и
+    текущей свече) и два по перекупленности (RSI >= уровня). В каждой паре 10 -
+    переход вниз, 01 - вверх. Если переходов два (скачок через оба уровня),
+    выбирается тип, стоящий раньше в priority.
+    """
+    table = np.full(16, -1, dtype=np.int8)
+    for state in range(16):
+        oversold_bits, overbought_bits = state >> 2, state & 3
+        crossed = {
+            "oversold_enter": oversold_bits == 2,
+            "oversold_exit": oversold_bits == 1,
+            "overbought_enter": overbought_bits == 1,
+            "overbought_exit": overbought_bits == 2,
+        }
+        for signal_type in priority:
+            if crossed[signal_type]:
+                table[state] = CROSSING_TYPES.index(signal_type)
+                break
+    return table
+
+
+# Приоритет проверки последней свечи (RSIAnalyzer.analyze_rsi_signals)
+LIVE_CROSSING_CODES = _crossing_table(("oversold_enter", "oversold_exit", "overbought_enter", "overbought_exit"))
+# Приоритет исторического анализа (scan_rsi_crossings)
+HISTORICAL_CROSSING_CODES = _crossing_table(CROSSING_TYPES)
+
+
+def crossing_state(previous, current, oversold: float, overbought: float):
+    """
+    Состояние перехода RSI между двумя свечами - индекс в таблицах *_CROSSING_CODES
+    
+    Работает и с числами, и с массивами NumPy без ветвлений; если одно из
+    значений NaN, состояние 0 (пересечения нет).
+    """
+    state = (((previous > oversold) * 2 + (current > oversold)) * 4
+             + (previous >= overbought) * 2 + (current >= overbought))
+    # NaN не равен сам себе
+    return state * ((previous == previous) & (current == current))
+
+
+# Ядра модуля собираются без fastmath: он разрешает компилятору считать, что NaN не бывает,
+# а RSI и состояние Уайлдера возвращают NaN и проверяются через isnan
+@njit(cache=True)
+def scan_rsi_crossings(rsi: np.ndarray, oversold: float, overbought: float) -> np.ndarray:
+    """
+    Поиск пересечений уровней RSI между соседними свечами (скомпилирован Numba)
+    
+    Args:
+        rsi: Массив значений RSI (float64, NaN - нет значения)
+        oversold: Уровень перепроданности
+        overbought: Уровень перекупленности
+    
+    Returns:
+        Массив int8 той же длины: для свечи i - индекс типа сигнала в CROSSING_TYPES
+        по переходу RSI со свечи i - 1, или -1, если пересечения нет
+    """
+    n = rsi.shape[0]
+    codes = np.full(n, -1, dtype=np.int8)
+    
+    for i in range(1, n):
+        prev = rsi[i - 1]
+        curr = rsi[i]
+        if np.isnan(prev) or np.isnan(curr):
+            continue
+            
+        # То же состояние, что в crossing_state: тип сигнала выбирается по таблице, без цепочки условий
+        state = ((prev > oversold) * 2 + (curr > oversold)) * 4 + (prev >= overbought) * 2 + (curr >= overbought)
+        codes[i] = HISTORICAL_CROSSING_CODES[state]
+            
+    return codes
+
 
 def calculate_rsi(data: pd.Series, period: int = 14) -> pd.Series:
     """
@@ -82,4 +302,10 @@ def add_rsi_to_dataframe(df: pd.DataFrame, close_column: str = 'close', period:
     """
     df = df.copy()
     df['rsi'] = calculate_rsi_with_ema(df[close_column], period)
-    return df 
\ No newline at end of file
+    return df
+
+
+# Прогрев JIT при импорте, чтобы не платить за компиляцию на первом запросе
+wilder_rsi(np.linspace(1.0, 2.0, 16), 14)
+wilder_state(np.linspace(1.0, 2.0, 16), 14)
+scan_rsi_crossings(np.linspace(20.0, 80.0, 16), 30.0, 70.0)
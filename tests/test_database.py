@@ -0,0 +1,176 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import RSIDatabase
+
+T0 = datetime(2024, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = RSIDatabase(f"sqlite:///{tmp_path / 'signals.db'}")
+    yield database
+    database.close()
+
+
+def _signal(timestamp, signal_type='oversold_enter', symbol='BTCUSDT', timeframe='5m'):
+    return {
+        'symbol': symbol,
+        'timeframe': timeframe,
+        'signal_type': signal_type,
+        'rsi_value': 29.5,
+        'price': 100.0,
+        'timestamp': timestamp,
+        'previous_rsi': 31.0
+    }
+
+
+@pytest.mark.parametrize("offset,expected", [
+    (0, True),
+    (119, True),
+    (-119, True),
+    (120, False),
+    (-120, False),
+])
+def test_has_recent_signal_window_edges(db, offset, expected):
+    db.add_signals([_signal(T0)])
+    # Окно открытое: сигнал ровно на расстоянии window_seconds дублем не считается
+    assert db.has_recent_signal('BTCUSDT', '5m', 'oversold_enter', T0 + timedelta(seconds=offset), 120) is expected
+
+
+def test_has_recent_signal_matches_type_symbol_and_timeframe(db):
+    db.add_signals([_signal(T0)])
+    assert not db.has_recent_signal('BTCUSDT', '5m', 'oversold_exit', T0, 120)
+    assert not db.has_recent_signal('ETHUSDT', '5m', 'oversold_enter', T0, 120)
+    assert not db.has_recent_signal('BTCUSDT', '1h', 'oversold_enter', T0, 120)
+
+
+def test_recent_signals_pages_keep_timestamp_ties(db):
+    # Сигналы по 3 на свечу: границы страниц по 4 строки попадают внутрь групп
+    signals = [
+        _signal(T0 + timedelta(minutes=5 * candle), signal_type, symbol)
+        for candle in range(5)
+        for signal_type, symbol in [('oversold_enter', 'BTCUSDT'), ('oversold_enter', 'ETHUSDT'), ('overbought_exit', 'BTCUSDT')]
+    ]
+    assert db.add_signals(signals) == len(signals)
+    
+    seen = []
+    before = None
+    while True:
+        page = db.get_recent_signals(limit=4, before=before)
+        if not page:
+            break
+        # Страница заканчивается целой группой сигналов одного времени
+        assert sum(s['timestamp'] == page[-1]['timestamp'] for s in page) == 3
+        seen.extend(page)
+        before = page[-1]['timestamp']
+        
+    keys = [(s['symbol'], s['signal_type'], s['timestamp']) for s in seen]
+    assert len(keys) == len(set(keys)) == len(signals)
+    assert [s['timestamp'] for s in seen] == sorted((s['timestamp'] for s in seen), reverse=True)
+
+
+def test_recent_signals_short_page_is_not_extended(db):
+    db.add_signals([_signal(T0), _signal(T0, symbol='ETHUSDT')])
+    assert len(db.get_recent_signals(limit=5)) == 2
+
+
+def _legacy_database(path, user_version: int):
+    """Файл SQLite старой версии схемы: дубли сигналов, нет уникального индекса"""
+    conn = sqlite3.connect(path)
+    if user_version == 0:
+        # Исходная схема: без previous_rsi, время строкой
+        conn.execute('''
+            CREATE TABLE rsi_signals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                symbol TEXT NOT NULL,
+                timeframe TEXT NOT NULL,
+                signal_type TEXT NOT NULL,
+                rsi_value REAL NOT NULL,
+                price REAL NOT NULL,
+                timestamp DATETIME NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        rows = [
+            ('BTCUSDT', '5m', 'oversold_enter', 29.0, 100.0, '2024-01-01 12:00:00'),
+            ('BTCUSDT', '5m', 'oversold_enter', 29.1, 100.5, '2024-01-01 12:00:00'),
+            ('BTCUSDT', '5m', 'oversold_exit', 31.0, 101.0, '2024-01-01 12:05:00'),
+        ]
+        conn.executemany(
+            'INSERT INTO rsi_signals (symbol, timeframe, signal_type, rsi_value, price, timestamp) VALUES (?, ?, ?, ?, ?, ?)',
+            rows
+        )
+    else:
+        conn.execute('''
+            CREATE TABLE rsi_signals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                symbol TEXT NOT NULL,
+                timeframe TEXT NOT NULL,
+                signal_type TEXT NOT NULL,
+                rsi_value REAL NOT NULL,
+                price REAL NOT NULL,
+                timestamp INTEGER NOT NULL,
+                previous_rsi REAL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        t0 = 1704110400  # 2024-01-01 12:00:00 UTC
+        rows = [
+            ('BTCUSDT', '5m', 'oversold_enter', 29.0, 100.0, t0, 31.0),
+            ('BTCUSDT', '5m', 'oversold_enter', 29.1, 100.5, t0, 31.0),
+            ('BTCUSDT', '5m', 'oversold_enter', 29.2, 100.7, t0, 31.0),
+            ('BTCUSDT', '5m', 'oversold_exit', 31.0, 101.0, t0 + 300, 29.0),
+        ]
+        conn.executemany(
+            'INSERT INTO rsi_signals (symbol, timeframe, signal_type, rsi_value, price, timestamp, previous_rsi) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            rows
+        )
+    conn.execute(f'PRAGMA user_version = {user_version}')
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize("user_version", [0, 1])
+def test_migration_removes_duplicates_and_adds_unique_index(tmp_path, user_version):
+    path = tmp_path / 'legacy.db'
+    _legacy_database(path, user_version)
+    
+    db = RSIDatabase(f"sqlite:///{path}")
+    try:
+        signals = db.get_recent_signals()
+        # Остается первая запись каждой группы, время - наивный datetime UTC
+        assert [(s['signal_type'], s['timestamp'], s['rsi_value']) for s in signals] == [
+            ('oversold_exit', T0 + timedelta(minutes=5), 31.0),
+            ('oversold_enter', T0, 29.0),
+        ]
+        
+        # Повтор сигнала той же свечи больше не записывается
+        assert db.add_signals([_signal(T0)]) == 0
+        assert db.count_signals() == 2
+    finally:
+        db.close()
+        
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == 2
+        indexes = {row[1] for row in conn.execute('PRAGMA index_list(rsi_signals)')}
+        assert 'idx_sig_unique' in indexes
+        assert conn.execute("SELECT COUNT(*) FROM rsi_signals WHERE typeof(timestamp) = 'text'").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def test_migration_runs_once(tmp_path):
+    path = tmp_path / 'legacy.db'
+    _legacy_database(path, 1)
+    RSIDatabase(f"sqlite:///{path}").close()
+    
+    db = RSIDatabase(f"sqlite:///{path}")
+    try:
+        assert db.count_signals() == 2
+    finally:
+        db.close()
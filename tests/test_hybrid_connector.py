@@ -0,0 +1,152 @@
+import asyncio
+import time
+from collections import deque
+
+from connectors import hybrid_connector
+from connectors.hybrid_connector import HEDGE_DELAY, LATENCY_MIN_SAMPLES, HybridConnector
+
+
+class FakeSource:
+    """Коннектор с заданной задержкой и ответом; помнит, сколько его запросов в полете"""
+    
+    def __init__(self, name, delay, error=None, valid=True, stats=None):
+        self.name = name
+        self.delay = delay
+        self.result = name if valid else None
+        self.error = error
+        self.stats = stats
+        self.cancelled = False
+        
+    async def call(self):
+        self.stats['started'].append(self.name)
+        self.stats['in_flight'] += 1
+        self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+        try:
+            await asyncio.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            return self.result
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        finally:
+            self.stats['in_flight'] -= 1
+
+
+def _hybrid() -> HybridConnector:
+    # Без HTTP-сессии и настоящих коннекторов: нужен только опрос цепочки
+    hybrid = HybridConnector.__new__(HybridConnector)
+    hybrid._latency = {}
+    return hybrid
+
+
+def _chain(*specs):
+    stats = {'started': [], 'in_flight': 0, 'max_in_flight': 0}
+    sources = [FakeSource(*spec, stats=stats) for spec in specs]
+    return tuple((source.name, source) for source in sources), stats
+
+
+def _set_p95(hybrid: HybridConnector, name: str, seconds: float):
+    hybrid._latency[(name, 'history')] = deque([seconds] * LATENCY_MIN_SAMPLES)
+
+
+async def _first(hybrid, chain):
+    return await hybrid._first_result(
+        'BTCUSDT', chain, 'history',
+        lambda source: source.call(),
+        lambda result: result is not None
+    )
+
+
+def test_hedge_delay_uses_p95_after_enough_samples():
+    hybrid = _hybrid()
+    for i in range(LATENCY_MIN_SAMPLES - 1):
+        hybrid._record_latency('binance', 'history', 0.1)
+    assert hybrid._hedge_delay('binance', 'history') == HEDGE_DELAY
+    
+    for seconds in (0.1,) * 9 + (2.0,) * 1:
+        hybrid._record_latency('binance', 'history', seconds)
+    # 19 замеров по 0.1 и один 2.0: 95-й перцентиль между ними
+    assert 0.1 < hybrid._hedge_delay('binance', 'history') < 2.0
+    # Задержки считаются отдельно по виду запроса
+    assert hybrid._hedge_delay('binance', 'price') == HEDGE_DELAY
+
+
+def test_fast_primary_does_not_start_backup():
+    async def run():
+        hybrid = _hybrid()
+        _set_p95(hybrid, 'binance', 0.2)
+        chain, stats = _chain(('binance', 0.01), ('kraken', 0.01))
+        
+        assert await _first(hybrid, chain) == ('binance', 'binance')
+        assert stats['started'] == ['binance']
+        
+    asyncio.run(run())
+
+
+def test_slow_primary_is_hedged_after_p95():
+    async def run():
+        hybrid = _hybrid()
+        _set_p95(hybrid, 'binance', 0.05)
+        _set_p95(hybrid, 'kraken', 0.05)
+        chain, stats = _chain(('binance', 1.0), ('kraken', 0.3), ('yahoo', 0.01))
+        
+        started = time.monotonic()
+        result = await _first(hybrid, chain)
+        elapsed = time.monotonic() - started
+        
+        # Резерв ушел через p95 основного, третий коннектор не запускался:
+        # в полете не больше двух запросов
+        assert result == ('kraken', 'kraken')
+        assert stats['started'] == ['binance', 'kraken']
+        assert stats['max_in_flight'] == 2
+        assert elapsed < 0.9
+        # Проигравший запрос отменен
+        await asyncio.sleep(0)
+        assert chain[0][1].cancelled
+        assert stats['in_flight'] == 0
+        
+    asyncio.run(run())
+
+
+def test_failed_connector_is_replaced_without_waiting():
+    async def run():
+        hybrid = _hybrid()
+        chain, stats = _chain(
+            ('binance', 0.01, RuntimeError('HTTP 451')),
+            ('kraken', 0.01, None, False),  # пустой ответ
+            ('yahoo', 0.01)
+        )
+        
+        started = time.monotonic()
+        result = await _first(hybrid, chain)
+        
+        # Ошибка и пустой ответ сразу передают очередь следующему, без ожидания HEDGE_DELAY
+        assert result == ('yahoo', 'yahoo')
+        assert stats['started'] == ['binance', 'kraken', 'yahoo']
+        assert stats['max_in_flight'] == 1
+        assert time.monotonic() - started < HEDGE_DELAY
+        
+    asyncio.run(run())
+
+
+def test_all_connectors_failing_returns_none():
+    async def run():
+        hybrid = _hybrid()
+        chain, _ = _chain(('binance', 0.01, RuntimeError('down')), ('kraken', 0.01, ValueError('bad')))
+        assert await _first(hybrid, chain) == (None, None)
+        assert await _first(hybrid, ()) == (None, None)
+        
+    asyncio.run(run())
+
+
+def test_success_records_latency():
+    async def run():
+        hybrid = _hybrid()
+        chain, _ = _chain(('binance', 0.01),)
+        await _first(hybrid, chain)
+        samples = hybrid._latency[('binance', 'history')]
+        assert len(samples) == 1 and samples[0] >= 0.0
+        assert samples.maxlen == hybrid_connector.LATENCY_SAMPLES
+        
+    asyncio.run(run())
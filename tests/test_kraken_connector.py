@@ -0,0 +1,99 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from connectors.kraken_connector import KrakenConnector
+from rsi_utils import wilder_rsi
+
+INTERVAL = 5  # минут
+LIMIT = 30
+
+
+class FakeKraken:
+    """Биржа с рядом 5-минутных свечей: отдает свечи начиная с since, как OHLC Kraken"""
+    
+    def __init__(self, n: int):
+        rng = np.random.default_rng(0)
+        self.closes = 100.0 + np.cumsum(rng.normal(0.0, 1.0, 200))
+        self.start = (int(time.time()) // 300 - 150) * 300
+        self.n = n
+        self.calls = []
+        # Свечи, которых биржа "не отдает" (пропуск данных)
+        self.missing = set()
+        
+    async def fetch_ohlc(self, symbol, kraken_symbol, interval, since, min_rows=1):
+        self.calls.append(since)
+        rows = [
+            i for i in range(self.n)
+            if self.start + i * 300 >= since and i not in self.missing
+        ]
+        if len(rows) < min_rows:
+            return None
+        close = self.closes[rows]
+        index = pd.DatetimeIndex(
+            (np.array([self.start + i * 300 for i in rows], dtype=np.int64) * 1000).view('datetime64[ms]'),
+            name='timestamp'
+        )
+        return pd.DataFrame({'open': close, 'high': close, 'low': close, 'close': close, 'volume': 1.0}, index=index)
+        
+    def expected_rsi(self) -> np.ndarray:
+        return wilder_rsi(self.closes[:self.n], 14)[-LIMIT:]
+
+
+def _connector(exchange: FakeKraken) -> KrakenConnector:
+    connector = KrakenConnector(SimpleNamespace(RSI_PERIOD=14), http=object())
+    connector._fetch_ohlc = exchange.fetch_ohlc
+    return connector
+
+
+async def _load(connector: KrakenConnector) -> pd.DataFrame:
+    # Повторные вызовы в тесте идут мимо TTL-кэша ответов
+    connector._cache._data.clear()
+    return await connector.get_historical_data('BTCUSDT', '5m', LIMIT)
+
+
+def test_incremental_update_matches_full_recompute():
+    """Новые свечи догружаются одним запросом с since, RSI совпадает с полным пересчетом"""
+    async def run():
+        exchange = FakeKraken(100)
+        connector = _connector(exchange)
+        df = await _load(connector)
+        
+        for n in (100, 101, 104):
+            anchor = df.index[-2]
+            exchange.n = n
+            exchange.calls.clear()
+            df = await _load(connector)
+            
+            # Один запрос, начиная с последней закрытой свечи кэша
+            assert exchange.calls == [int(anchor.timestamp()) - 1]
+            np.testing.assert_allclose(df['rsi'].to_numpy(), exchange.expected_rsi(), rtol=1e-9)
+            
+    asyncio.run(run())
+
+
+def test_gap_after_anchor_forces_full_reload():
+    """Если в ответе на since нет последней закрытой свечи кэша, ряд загружается заново"""
+    async def run():
+        exchange = FakeKraken(100)
+        connector = _connector(exchange)
+        first = await _load(connector)
+        anchor = first.index[-2]
+        
+        exchange.n = 103
+        exchange.missing = {98}  # свеча anchor
+        exchange.calls.clear()
+        df = await _load(connector)
+        
+        # Инкрементальный запрос с since на секунду раньше anchor, затем полная загрузка
+        assert exchange.calls[0] == int(anchor.timestamp()) - 1
+        assert len(exchange.calls) == 2 and exchange.calls[1] < exchange.calls[0]
+        assert anchor not in df.index
+        
+        closes = np.delete(exchange.closes[:exchange.n], 98)
+        np.testing.assert_allclose(df['rsi'].to_numpy(), wilder_rsi(closes, 14)[-LIMIT:], rtol=1e-9)
+        
+    asyncio.run(run())
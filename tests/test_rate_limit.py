@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from connectors.rate_limit import AsyncTokenBucket
+
+
+def test_burst_is_immediate_then_paced_at_rate():
+    async def run():
+        bucket = AsyncTokenBucket(rate=20.0, burst=3)
+        started = time.monotonic()
+        times = []
+        for _ in range(7):
+            await bucket.acquire()
+            times.append(time.monotonic() - started)
+        return times
+        
+    times = asyncio.run(run())
+    
+    # Первые burst запросов без ожидания, дальше по одному на 1/rate секунды
+    assert times[2] < 0.03
+    assert 0.18 <= times[-1] < 0.4
+    gaps = [b - a for a, b in zip(times[2:], times[3:])]
+    assert all(gap > 0.03 for gap in gaps)
+
+
+def test_concurrent_waiters_are_queued():
+    async def run():
+        bucket = AsyncTokenBucket(rate=10.0, burst=1)
+        started = time.monotonic()
+        
+        async def acquire():
+            await bucket.acquire()
+            return time.monotonic() - started
+            
+        return sorted(await asyncio.gather(*[acquire() for _ in range(4)]))
+        
+    times = asyncio.run(run())
+    
+    # Токены резервируются по очереди: 0, 0.1, 0.2, 0.3 секунды
+    for i, elapsed in enumerate(times):
+        assert i * 0.1 - 0.01 <= elapsed < i * 0.1 + 0.08
+
+
+def test_idle_bucket_refills_only_up_to_burst():
+    async def run():
+        bucket = AsyncTokenBucket(rate=50.0, burst=2)
+        await bucket.acquire()
+        await bucket.acquire()
+        await asyncio.sleep(0.2)  # за это время набралось бы 10 токенов
+        
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        return time.monotonic() - started
+        
+    # Два токена есть, третий ждет 1/rate
+    assert 0.015 <= asyncio.run(run()) < 0.1
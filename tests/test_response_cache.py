@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from connectors import response_cache
+from connectors.response_cache import ResponseCache, SingleFlight
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое time.monotonic модуля кэша"""
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_response_cache_expires_after_ttl(clock):
+    cache = ResponseCache()
+    cache.set('key', 'value')
+    
+    clock[0] += 9.99
+    assert cache.get('key', 10) == 'value'
+    
+    # Ровно через ttl запись уже устарела и удаляется
+    clock[0] += 0.01
+    assert cache.get('key', 10) is None
+    assert 'key' not in cache._data
+
+
+def test_response_cache_ttl_is_per_read(clock):
+    cache = ResponseCache()
+    cache.set('key', 'value')
+    clock[0] += 30
+    assert cache.get('key', 60) == 'value'
+    assert cache.get('key', 5) is None
+
+
+def test_response_cache_evicts_least_recently_used(clock):
+    cache = ResponseCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a', 10)
+    cache.set('c', 3)
+    
+    assert cache.get('b', 10) is None
+    assert cache.get('a', 10) == 1
+    assert cache.get('c', 10) == 3
+
+
+def test_single_flight_shares_one_call():
+    async def run():
+        flight = SingleFlight()
+        calls = []
+        
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+            
+        results = await asyncio.gather(*[flight.run('key', load) for _ in range(5)])
+        assert results == [1] * 5
+        assert calls == [1]
+        
+        # Завершенный запрос не кэшируется: следующий вызов идет заново
+        assert await flight.run('key', load) == 2
+        assert flight._inflight == {}
+        
+    asyncio.run(run())
+
+
+def test_single_flight_keys_are_independent():
+    async def run():
+        flight = SingleFlight()
+        
+        async def load(value):
+            await asyncio.sleep(0.01)
+            return value
+            
+        results = await asyncio.gather(flight.run('a', lambda: load('a')), flight.run('b', lambda: load('b')))
+        assert results == ['a', 'b']
+        
+    asyncio.run(run())
+
+
+def test_single_flight_cancels_call_when_all_waiters_cancelled():
+    async def run():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+        
+        async def load():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+                
+        waiters = [asyncio.create_task(flight.run('key', load)) for _ in range(2)]
+        await started.wait()
+        
+        # Один из двух ожидающих отменен - запрос продолжается для второго
+        waiters[0].cancel()
+        await asyncio.sleep(0)
+        assert not cancelled.is_set()
+        
+        waiters[1].cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert flight._inflight == {}
+        
+    asyncio.run(run())
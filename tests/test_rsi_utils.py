@@ -0,0 +1,125 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from rsi_utils import (
+    CROSSING_TYPES,
+    HISTORICAL_CROSSING_CODES,
+    LIVE_CROSSING_CODES,
+    crossing_state,
+    scan_rsi_crossings,
+    wilder_extend,
+    wilder_rsi,
+    wilder_state,
+)
+
+PERIOD = 14
+OVERSOLD = 30.0
+OVERBOUGHT = 70.0
+# Значения на уровнях, рядом с ними, между ними и NaN
+RSI_GRID = [np.nan, 0.0, 29.99, 30.0, 30.01, 50.0, 69.99, 70.0, 70.01, 100.0]
+
+
+def _random_walk(n: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return 100.0 + np.cumsum(rng.normal(0.0, 1.0, n))
+
+
+@pytest.mark.parametrize("split", [PERIOD + 2, 50, 199])
+def test_wilder_extend_matches_full_recompute(split):
+    """Состояние на последней закрытой свече + продолжение = полный пересчет wilder_rsi"""
+    close = _random_walk(200)
+    full = wilder_rsi(close, PERIOD)
+    
+    # Свеча split - 1 закрыта, новые свечи - close[split:]
+    avg_gain, avg_loss = wilder_state(close[:split], PERIOD)
+    rsi, new_gain, new_loss = wilder_extend(avg_gain, avg_loss, close[split - 1], close[split:], PERIOD)
+    
+    np.testing.assert_allclose(rsi, full[split:], rtol=1e-12)
+    # Новое состояние - на предпоследней (последней закрытой) свече
+    np.testing.assert_allclose((new_gain, new_loss), wilder_state(close[:-1], PERIOD), rtol=1e-12)
+
+
+def test_wilder_extend_chained_updates_match_full_recompute():
+    """Много шагов подряд, как в кэше коннекторов: ошибка не накапливается"""
+    close = _random_walk(500, seed=1)
+    full = wilder_rsi(close, PERIOD)
+    
+    # Первая загрузка: свечи до end, последняя (end - 1) еще формируется
+    end = 100
+    avg_gain, avg_loss = wilder_state(close[:end - 1], PERIOD)
+    rng = np.random.default_rng(2)
+    
+    while end < len(close):
+        # Формирующаяся свеча переписывается, плюс 0-3 новых
+        new_end = min(len(close), end + int(rng.integers(0, 4)))
+        anchor = end - 2
+        rsi, avg_gain, avg_loss = wilder_extend(avg_gain, avg_loss, close[anchor], close[anchor + 1:new_end], PERIOD)
+        np.testing.assert_allclose(rsi, full[anchor + 1:new_end], rtol=1e-9)
+        end = new_end
+
+
+def test_wilder_state_short_series_is_nan():
+    """Для ряда короче period + 1 цен состояния нет"""
+    avg_gain, avg_loss = wilder_state(_random_walk(PERIOD), PERIOD)
+    assert np.isnan(avg_gain) and np.isnan(avg_loss)
+
+
+def _live_chain(previous, current):
+    """Прежняя цепочка условий RSIAnalyzer.analyze_rsi_signals"""
+    if np.isnan(previous) or np.isnan(current):
+        return None
+    if previous > OVERSOLD and current <= OVERSOLD:
+        return "oversold_enter"
+    elif previous <= OVERSOLD and current > OVERSOLD:
+        return "oversold_exit"
+    elif previous < OVERBOUGHT and current >= OVERBOUGHT:
+        return "overbought_enter"
+    elif previous >= OVERBOUGHT and current < OVERBOUGHT:
+        return "overbought_exit"
+    return None
+
+
+def _historical_chain(previous, current):
+    """Прежняя цепочка условий RSIAnalyzer.analyze_historical_rsi_signals"""
+    if np.isnan(previous) or np.isnan(current):
+        return None
+    if previous <= OVERSOLD and current > OVERSOLD:
+        return "oversold_exit"
+    elif previous >= OVERBOUGHT and current < OVERBOUGHT:
+        return "overbought_exit"
+    elif previous > OVERSOLD and current <= OVERSOLD:
+        return "oversold_enter"
+    elif previous < OVERBOUGHT and current >= OVERBOUGHT:
+        return "overbought_enter"
+    return None
+
+
+def _lookup(table, previous, current):
+    code = table[crossing_state(previous, current, OVERSOLD, OVERBOUGHT)]
+    return None if code < 0 else CROSSING_TYPES[code]
+
+
+@pytest.mark.parametrize("previous,current", list(itertools.product(RSI_GRID, repeat=2)))
+def test_crossing_tables_match_priority_chains(previous, current):
+    assert _lookup(LIVE_CROSSING_CODES, previous, current) == _live_chain(previous, current)
+    assert _lookup(HISTORICAL_CROSSING_CODES, previous, current) == _historical_chain(previous, current)
+
+
+def test_crossing_state_on_arrays_matches_scalars():
+    pairs = np.array(list(itertools.product(RSI_GRID, repeat=2)))
+    states = crossing_state(pairs[:, 0], pairs[:, 1], OVERSOLD, OVERBOUGHT)
+    expected = [crossing_state(previous, current, OVERSOLD, OVERBOUGHT) for previous, current in pairs]
+    np.testing.assert_array_equal(states, expected)
+
+
+def test_scan_rsi_crossings_matches_historical_chain():
+    rng = np.random.default_rng(3)
+    rsi = rng.choice(RSI_GRID, 5000)
+    codes = scan_rsi_crossings(rsi, OVERSOLD, OVERBOUGHT)
+    
+    assert codes[0] == -1
+    for i in range(1, len(rsi)):
+        expected = _historical_chain(rsi[i - 1], rsi[i])
+        assert (None if codes[i] < 0 else CROSSING_TYPES[codes[i]]) == expected
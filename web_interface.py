@@ -57,6 +57,7 @@ class WebInterface:
         # API для управления пользователями Telegram
         self.cors.add(self.app.router.add_get('/api/telegram_users', self.get_telegram_users_api))
         self.cors.add(self.app.router.add_post('/api/telegram_users', self.add_telegram_user_api))
+        self.cors.add(self.app.router.add_get('/api/telegram_users/{user_id}', self.get_telegram_user_api))
         self.cors.add(self.app.router.add_post('/api/telegram_users/{user_id}/approve', self.approve_telegram_user_api))
         self.cors.add(self.app.router.add_post('/api/telegram_users/{user_id}/block', self.block_telegram_user_api))
         self.cors.add(self.app.router.add_delete('/api/telegram_users/{user_id}', self.delete_telegram_user_api))
@@ -68,7 +69,7 @@ class WebInterface:
         """Главная страница"""
         try:
             # Получаем последние сигналы
-            recent_signals = self.database.get_recent_signals(50)
+            recent_signals = self.database.get_recent_signals(limit=50)
             
             # Получаем настройки пользователя
             user_settings = self.database.get_user_settings()
@@ -96,7 +97,9 @@ class WebInterface:
         """API для получения сигналов"""
         try:
             limit = int(request.query.get('limit', 100))
-            signals = self.database.get_recent_signals(limit)
+            # Следующая страница: before = timestamp последнего сигнала предыдущей
+            before = request.query.get('before')
+            signals = self.database.get_recent_signals(limit=limit, before=before)
             
             # Конвертируем datetime в строку для JSON
             for signal in signals:
@@ -114,8 +117,9 @@ class WebInterface:
         try:
             symbol = request.match_info['symbol']
             limit = int(request.query.get('limit', 50))
+            before = request.query.get('before')
             
-            signals = self.database.get_signals_by_symbol(symbol, limit)
+            signals = self.database.get_signals_by_symbol(symbol, limit, before)
             
             # Конвертируем datetime в строку для JSON
             for signal in signals:
@@ -265,7 +269,7 @@ class WebInterface:
             status = {
                 'running': self.rsi_bot is not None and self.rsi_bot.is_running if hasattr(self.rsi_bot, 'is_running') else False,
                 'last_check': datetime.now().isoformat(),
-                'total_signals': len(self.database.get_recent_signals(1000)),
+                'total_signals': await asyncio.to_thread(self.database.count_signals),
                 'database_connected': True
             }
             
@@ -389,8 +393,8 @@ class WebInterface:
                 return web.json_response({'error': 'База данных не доступна'}, status=500)
             
             # Получаем пользователей
-            logger.info("Вызываем database.get_telegram_users()")
-            users = self.database.get_telegram_users()
+            logger.info("Вызываем database.get_telegram_users_brief()")
+            users = self.database.get_telegram_users_brief()
             
             logger.info(f"Получено {len(users)} пользователей Telegram")
             
@@ -400,16 +404,6 @@ class WebInterface:
                     user['created_at'] = user['created_at'].isoformat()
                 elif user.get('created_at'):
                     user['created_at'] = str(user['created_at'])
-                    
-                if user.get('approved_at') and hasattr(user['approved_at'], 'isoformat'):
-                    user['approved_at'] = user['approved_at'].isoformat()
-                elif user.get('approved_at'):
-                    user['approved_at'] = str(user['approved_at'])
-                    
-                if user.get('last_activity') and hasattr(user['last_activity'], 'isoformat'):
-                    user['last_activity'] = user['last_activity'].isoformat()
-                elif user.get('last_activity'):
-                    user['last_activity'] = str(user['last_activity'])
             
             return web.json_response(users)
             
@@ -420,6 +414,28 @@ class WebInterface:
             logger.error(f"Traceback: {traceback.format_exc()}")
             return web.json_response({'error': str(e)}, status=500)
             
+    async def get_telegram_user_api(self, request: web_request.Request):
+        """API для получения всех полей одного пользователя Telegram"""
+        try:
+            user_id = int(request.match_info['user_id'])
+            
+            user = await asyncio.to_thread(self.database.get_telegram_user_detail, user_id)
+            if user is None:
+                return web.json_response({'error': 'Пользователь не найден'}, status=404)
+                
+            # Конвертируем datetime в строку для JSON
+            for field in ('created_at', 'approved_at', 'last_activity'):
+                if user.get(field) and hasattr(user[field], 'isoformat'):
+                    user[field] = user[field].isoformat()
+                elif user.get(field):
+                    user[field] = str(user[field])
+                    
+            return web.json_response(user)
+            
+        except Exception as e:
+            logger.error(f"Ошибка при получении пользователя Telegram: {str(e)}")
+            return web.json_response({'error': str(e)}, status=500)
+            
     async def add_telegram_user_api(self, request: web_request.Request):
         """API для добавления пользователя Telegram вручную"""
         try: